@@ -1,25 +1,76 @@
-from .aa import TAAmbk
-from .border import Crop, CropAbs, AddBorders
-from .compare import Interleave
-from .crop_after import CropAfter
-from .crop_before import CropBefore
-from .deband import f3kdb
-from .deblock import FastDeblock, OysterDeblock
-from .deinterlace import IT, VIVTC, TIVTC, Yadifmod, Bwdif, QTGMC
-from .delogo import Delogo
-from .denoise import SMDegrain, SMDegrainFast, BM3D, Waifu2xCaffe, Waifu2xW2XC, NLMeans, VagueDenoiser
-from .dering import FineDehalo, LGhost
-from .edge_refine import EdgeRefine
-from .framerate import ChangeFPS, FrameRate, VFRToCFR
-from .line_clearness import LineClearness
-from .line_sharp import LineSharp
-from .format import Format
-from .mcfi import SVP
-from .post_process import CSMOD
-from .resolution import Resolution
-from .source import LWLibavSource, LSMASHVideoSource, FFmpegSource, AVISource, MultiSource
-from .subtitle import VSFilterMod, Subtext, InfoText
-from .trim_frames import TrimFrames
-from .sharpen import FineSharp, CAS
-from .upscale import Waifu2xExpandCaffe, Waifu2xExpandNcnn, Anime4K
-from .store import StoreClip, LoadClip
+import importlib
+
+# filter name -> module, modules are only imported when one of their filters is used
+_registry = {
+    'TAAmbk': 'aa',
+    'Crop': 'border',
+    'CropAbs': 'border',
+    'AddBorders': 'border',
+    'Interleave': 'compare',
+    'CropAfter': 'crop_after',
+    'CropBefore': 'crop_before',
+    'f3kdb': 'deband',
+    'FastDeblock': 'deblock',
+    'OysterDeblock': 'deblock',
+    'IT': 'deinterlace',
+    'VIVTC': 'deinterlace',
+    'TIVTC': 'deinterlace',
+    'Yadifmod': 'deinterlace',
+    'Bwdif': 'deinterlace',
+    'QTGMC': 'deinterlace',
+    'Delogo': 'delogo',
+    'SMDegrain': 'denoise',
+    'SMDegrainFast': 'denoise',
+    'BM3D': 'denoise',
+    'Waifu2xCaffe': 'denoise',
+    'Waifu2xW2XC': 'denoise',
+    'NLMeans': 'denoise',
+    'VagueDenoiser': 'denoise',
+    'FineDehalo': 'dering',
+    'LGhost': 'dering',
+    'EdgeRefine': 'edge_refine',
+    'ChangeFPS': 'framerate',
+    'FrameRate': 'framerate',
+    'VFRToCFR': 'framerate',
+    'LineClearness': 'line_clearness',
+    'LineSharp': 'line_sharp',
+    'Format': 'format',
+    'SVP': 'mcfi',
+    'CSMOD': 'post_process',
+    'SceneChange': 'scene',
+    'Resolution': 'resolution',
+    'LWLibavSource': 'source',
+    'LSMASHVideoSource': 'source',
+    'FFmpegSource': 'source',
+    'AVISource': 'source',
+    'MultiSource': 'source',
+    'VSFilterMod': 'subtitle',
+    'Subtext': 'subtitle',
+    'InfoText': 'subtitle',
+    'TrimFrames': 'trim_frames',
+    'FineSharp': 'sharpen',
+    'CAS': 'sharpen',
+    'Waifu2xExpandCaffe': 'upscale',
+    'Waifu2xExpandNcnn': 'upscale',
+    'Anime4K': 'upscale',
+    'StoreClip': 'store',
+    'LoadClip': 'store',
+    'CheckpointClip': 'store',
+    'StoreMotion': 'motion',
+}
+
+def get_filter(name):
+    if name not in _registry:
+        return None
+    module = importlib.import_module(f'.{_registry[name]}', __name__)
+    return getattr(module, name)
+
+def __getattr__(name):
+    flt = get_filter(name)
+    if flt is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    globals()[name] = flt
+    return flt
+
+def __dir__():
+    return sorted(list(globals()) + list(_registry))
@@ -3,7 +3,7 @@ import vapoursynth as vs
 from third_party import Oyster
 from third_party import mvsfunc as mvf
 
-from .utils import ConfigureError
+from .utils import ConfigureError, constant_clip
 
 class FastDeblock:
     def __init__(self, _, radius_temporal, radius_spatial, h=3.2, lowpass=[0.0, 0.0, 0.48, 1024.0, 1.0, 1024.0]):
@@ -47,6 +47,10 @@ class FastDeblock:
         return clip
 
     def genblockmask(self, src):
+        key = ('FastDeblock.blockmask', src.format.id, src.width, src.height, src.fps_num, src.fps_den)
+        return constant_clip(key, lambda: self.buildblockmask(src), src.num_frames)
+
+    def buildblockmask(self, src):
         core            = vs.core
         Resample        = core.fmtc.resample
         BlankClip       = core.std.BlankClip
@@ -55,7 +59,7 @@ class FastDeblock:
         StackVertical   = core.std.StackVertical
         Expr            = core.std.Expr
         CropAbs         = core.std.CropAbs
-        clip            = BlankClip(src, 24, 24, color=0.0)
+        clip            = BlankClip(src, 24, 24, length=1, color=0.0)
         clip            = AddBorders(clip, 4, 4, 4, 4, color=1.0)
         clip            = StackHorizontal([clip, clip, clip, clip])
         clip            = StackVertical([clip, clip, clip, clip])
@@ -1,6 +1,6 @@
 from third_party import havsfunc as haf
 
-from .utils import ConfigureError, SimpleFilter
+from .utils import ConfigureError, SimpleFilter, select_by_props
 
 
 @SimpleFilter
@@ -12,9 +12,9 @@ def IT(core, clip, _, fps):
 def VIVTC(core, clip, _, field_order, mode):
     matched_clip = core.vivtc.VFM(clip, order=field_order, mode=mode)
     deinterlaced_clip = core.eedi3.eedi3(matched_clip, field=1)
-    callback = lambda n, f: deinterlaced_clip if f.props['_Combed'] > 0 else matched_clip
-    processed_clip = core.std.FrameEval(
-        matched_clip, callback, prop_src=matched_clip)
+    callback = lambda n, f: 1 if f.props['_Combed'] > 0 else 0
+    processed_clip = select_by_props(
+        core, [matched_clip, deinterlaced_clip], matched_clip, 'x._Combed 0 > 1 0 ?', callback)
     return core.vivtc.VDecimate(processed_clip)
 
 
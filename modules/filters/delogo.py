@@ -6,7 +6,7 @@ import vapoursynth
 from third_party import mvsfunc as mvf
 from third_party import logonr_vs as logonr
 
-from .utils import ConfigureError, get_working_directory
+from .utils import ConfigureError, get_working_directory, select_frames, select_by_props, constant_clip
 
 
 class Delogo:
@@ -44,16 +44,17 @@ class Delogo:
         if autodetect:
             auto_dlg = self.auto_delogo(clip, dlg)
         core = vapoursynth.core
+        clips = [clip, dlg, auto_dlg]
         def decide(n):
             for start, end in frames:
                 if abs(n - start) < autodetect:
-                    return auto_dlg
+                    return 2
                 if abs(n - end) < autodetect:
-                    return auto_dlg
+                    return 2
                 if n >= start and n <= end:
-                    return dlg
-            return clip
-        res = core.std.FrameEval(clip, decide)
+                    return 1
+            return 0
+        res = select_frames(clips, decide)
 
         nr = logonr.logoNR(core=core, dlg=res, src=clip, chroma=self.chroma, degrain=self.degrain)
         return mvf.Depth(nr, depth=16, fulls=False, dither=3)
@@ -76,12 +77,14 @@ class Delogo:
         dlg_e_v = core.std.ShufflePlanes(dlg_e_a, 2, vapoursynth.GRAY)
         dlg_e = core.std.Expr([dlg_e_y, dlg_e_u, dlg_e_v], 'x y max z max')
 
-        wlogo = core.std.BlankClip(clip, color=[128,128,128], length=1)
-        wlogo = core.delogo.EraseLogo(wlogo, self.logo_file)
-        wlogo = core.std.Crop(wlogo, left=self.l, right=self.r, top=self.t, bottom=self.b)
-        wlogo = core.std.ShufflePlanes(wlogo, 0, vapoursynth.GRAY)
-        logo_e = core.tcanny.TCanny(wlogo, mode=1, sigma=0.5)
-        logo_e = logo_e * clip.num_frames
+        def build_logo_e():
+            wlogo = core.std.BlankClip(clip, color=[128,128,128], length=1)
+            wlogo = core.delogo.EraseLogo(wlogo, self.logo_file)
+            wlogo = core.std.Crop(wlogo, left=self.l, right=self.r, top=self.t, bottom=self.b)
+            wlogo = core.std.ShufflePlanes(wlogo, 0, vapoursynth.GRAY)
+            return core.tcanny.TCanny(wlogo, mode=1, sigma=0.5)
+        key = ('Delogo.logo_e', self.logo_file, self.l, self.r, self.t, self.b, clip.format.id, clip.width, clip.height, clip.fps_num, clip.fps_den)
+        logo_e = constant_clip(key, build_logo_e, clip.num_frames)
 
         clip_l = core.std.Expr([clip_e, dlg_e, logo_e], 'x y 1.2 * > x z * 256 / 0 ?')
         dlg_l = core.std.Expr([dlg_e, clip_e, logo_e], 'x y 1.2 * > x z * 256 / 0 ?')
@@ -93,13 +96,13 @@ class Delogo:
             clip_avg = f[0].props['PlaneStatsAverage']
             dlg_avg = f[1].props['PlaneStatsAverage']
             if clip_avg * 1.2 < dlg_avg: # 1.2 needs to be further tested
-                return clip
+                return 0
             else:
                 # when at very bright background or a logo exists but delogo is not very clean,
                 # clip_avg ~= dlg_avg
                 # so apply delogo
-                return dlg
-        return core.std.FrameEval(clip, decide, prop_src=[clip_st, dlg_st])
+                return 1
+        return select_by_props(core, [clip, dlg], [clip_st, dlg_st], 'x.PlaneStatsAverage 1.2 * y.PlaneStatsAverage < 0 1 ?', decide)
 
     def get_frames(self, frames, offset):
         frame = 0
@@ -1,55 +1,61 @@
 import vapoursynth as vs
 
-from third_party import havsfunc as haf
 from third_party import mvsfunc as mvf
+from third_party import havsfunc as haf
+from third_party.vsrgtools import contrasharpening
 
 from .utils import ConfigureError, SimpleFilter
+from .format import resample_444p16
+from .motion import get_motion, load_motion, motion_clip
 
 
 @SimpleFilter
-def SMDegrain(core, clip, _):
-    clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
-    dei16 = mvf.Depth(clip, depth=16, fulls=False)
-    return haf.SMDegrain(
-        dei16,
-        tr=4,
-        thSAD=300,
-        thSCD1=1200,
-        blksize=16,
-        search=5,
-        prefilter=4,
-        contrasharp=True,
-        RefineMotion=True,
-        pel=2,
-        truemotion=False,
-        hpad=16,
-        vpad=16, )
+def SMDegrain(core, clip, _, vectors=None):
+    dei16 = motion_clip(core, clip)
+    if vectors is None:
+        mvtools = get_motion(
+            dei16,
+            tr=4,
+            block_size=16,
+            pel=2,
+            refine=1,
+            search='UMH',
+            prefilter='NLMEANS',
+            truemotion=False,
+            hpad=16,
+            vpad=16, )
+    else:
+        mvtools = load_motion(vectors, dei16, 4)
+    den = mvtools.degrain(thSAD=300, thSCD=(1200, None))
+    return contrasharpening(den, dei16)
 
 
 @SimpleFilter
-def SMDegrainFast(core, clip, _):
-    clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
-    dei16 = mvf.Depth(clip, depth=16, fulls=False)
-    return haf.SMDegrain(
-        dei16,
-        tr=2,
-        blksize=32,
-        overlap=16,
-        prefilter=4,
-        contrasharp=30,
-        RefineMotion=True,
-        pel=1,
-        truemotion=True,
-        hpad=0,
-        vpad=0, )
+def SMDegrainFast(core, clip, _, vectors=None):
+    dei16 = motion_clip(core, clip)
+    if vectors is None:
+        mvtools = get_motion(
+            dei16,
+            tr=2,
+            block_size=32,
+            pel=1,
+            refine=1,
+            overlap=16,
+            search='HEXAGON',
+            prefilter='NLMEANS',
+            truemotion=True,
+            hpad=0,
+            vpad=0, )
+    else:
+        mvtools = load_motion(vectors, dei16, 2)
+    # havsfunc.SMDegrain defaults, contrasharp=30 meant LSFmod sharpening at strength 30
+    den = mvtools.degrain(thSAD=300, thSCD=(400, None))
+    return haf.LSFmod(den, strength=30, source=dei16, Lmode=0, soothe=False, defaults='slow')
 
 
 @SimpleFilter
 def BM3D(core, clip, _, strength, radius, profile):
     clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
     rgbs = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in=1, matrix_in_s="709", range_in_s="limited", filter_param_a=0, filter_param_b=0.5)
     den = mvf.BM3D(
         rgbs,
@@ -63,7 +69,6 @@ def BM3D(core, clip, _, strength, radius, profile):
 @SimpleFilter
 def Waifu2xNCNN(core, clip, _, noise, block, model, gpu, multi_threads, precision=16):
     clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
     rgbs = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in=1, matrix_in_s="709", range_in_s="limited", filter_param_a=0, filter_param_b=0.5)
     def create_filter(clip, gpu):
         return core.w2xnvk.Waifu2x(
@@ -90,7 +95,6 @@ def Waifu2xNCNN(core, clip, _, noise, block, model, gpu, multi_threads, precisio
 @SimpleFilter
 def Waifu2xCaffe(core, clip, _, noise, block_w, block_h, model, cudnn, processor, tta, batch, multi_threads):
     clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
     rgbs = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in=1, matrix_in_s="709", range_in_s="limited", filter_param_a=0, filter_param_b=0.5)
     def create_filter(clip, processor):
         return core.caffe.Waifu2x(
@@ -123,7 +127,6 @@ def Waifu2xCaffe(core, clip, _, noise, block_w, block_h, model, cudnn, processor
 @SimpleFilter
 def Waifu2xW2XC(core, clip, _, noise, block, model_photo, processor, gpu, list_gpu):
     clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
     rgbs = core.resize.Bicubic(clip, format=vs.RGBS, matrix_in=1, matrix_in_s="709", range_in_s="limited", filter_param_a=0, filter_param_b=0.5)
     exp = core.w2xc.Waifu2x(
         rgbs,
@@ -145,9 +148,7 @@ def Waifu2xW2XC(core, clip, _, noise, block, model_photo, processor, gpu, list_g
 
 @SimpleFilter
 def NLMeans(core, clip, _, strength=1.2, tr=1, sr=2, nr=4, channel="auto", device_type="auto", device_id=0, info=False):
-    clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
-    dei16 = mvf.Depth(clip, depth=16, fulls=False)
+    dei16 = resample_444p16(core, clip)
     return core.knlm.KNLMeansCL(
         dei16,
         d=tr,
@@ -162,9 +163,7 @@ def NLMeans(core, clip, _, strength=1.2, tr=1, sr=2, nr=4, channel="auto", devic
 
 @SimpleFilter
 def VagueDenoiser(core, clip, _, strength, nsteps, csp):
-    clip = core.fmtc.resample(clip, css="444", csp=vs.YUV444PS, fulls=False)
-    clip = core.fmtc.matrix(clip, mat="709", mats="709", matd="709", fulls=False, bits=32)
-    dei16 = mvf.Depth(clip, depth=16, fulls=False)
+    dei16 = resample_444p16(core, clip)
     return core.vd.VagueDenoiser(
         dei16,
         threshold=strength,
@@ -0,0 +1,23 @@
+import os
+import hashlib
+
+# no VapourSynth imports here, TreeDiagram uses these too
+
+def file_digest(path, sample=1 << 20, samples=16):
+    '''
+    Hash of the content of a file, of samples evenly spread chunks for files
+    larger than that, so a multi-GB source is keyed without reading all of it.
+    The same file has the same digest wherever it is placed, and after a copy or touch.
+    '''
+    h = hashlib.sha1()
+    size = os.path.getsize(path)
+    h.update(str(size).encode('ascii'))
+    with open(path, 'rb') as f:
+        if size <= sample * samples:
+            for chunk in iter(lambda: f.read(sample), b''):
+                h.update(chunk)
+        else:
+            for i in range(samples):
+                f.seek((size - sample) * i // (samples - 1))
+                h.update(f.read(sample))
+    return h.hexdigest()
@@ -3,6 +3,7 @@ import vapoursynth as vs
 from third_party import mvsfunc as mvf
 
 from .utils import ConfigureError
+from .resolution import Resolution
 
 format_limits = [
                 'GRAY8',
@@ -115,3 +116,96 @@ class Format:
         else:
             clip = core.resize.Bicubic(clip, format=getattr(vs, self.format))
         return clip
+
+
+def resample_444p16(core, clip):
+    if clip.format.color_family == vs.YUV and clip.format.subsampling_w == 0 and clip.format.subsampling_h == 0 \
+       and clip.format.sample_type == vs.INTEGER and clip.format.bits_per_sample == 16:
+        return clip
+    return core.fmtc.resample(clip, css="444", csp=vs.YUV444P16, fulls=False)
+
+
+class FormatChain:
+    '''
+    Adjacent Format and Resolution steps, fused at run time when the input format is known:
+      - runs of Resample_* and Resolution become a single fmtc.resample call,
+      - lossless depth up-conversions right before such a run are dropped (fmtc.resample
+        reads any depth and always outputs 16 bit integer or float),
+      - a run that would not change the subsampling, size or depth of the clip is dropped.
+    Other formats are applied as they are.
+    '''
+    def __init__(self, steps):
+        self.steps = steps
+
+    @staticmethod
+    def parse(step):
+        if isinstance(step, Resolution):
+            return ('resolution', step.width, step.height, False)
+        name = step.format
+        if name.startswith('Resample_YUV'):
+            return ('resample', name[12:15], None, name.endswith('_Full'))
+        if name.startswith('Depth_'):
+            return ('depth', int(name.split('_')[1]), None, name.endswith('_Full'))
+        return ('other', step, None, None)
+
+    def __call__(self, core, clip):
+        ops = [self.parse(step) for step in self.steps]
+        i = 0
+        while i < len(ops):
+            kind, a, _, full = ops[i]
+            if kind == 'depth':
+                fmt = clip.format
+                if i + 1 < len(ops) and ops[i + 1][0] in ('resample', 'resolution') and ops[i + 1][3] == full \
+                   and fmt.sample_type == vs.INTEGER and fmt.bits_per_sample <= a <= 16:
+                    i += 1
+                    continue
+                clip = mvf.Depth(clip, depth=a, fulls=full, fulld=full, dither=3)
+                i += 1
+            elif kind in ('resample', 'resolution'):
+                run = []
+                while i < len(ops) and ops[i][0] in ('resample', 'resolution'):
+                    if ops[i][0] == 'resample' and any(op[0] == 'resample' and op[3] != ops[i][3] for op in run):
+                        break
+                    run.append(ops[i])
+                    i += 1
+                clip = self.resample(core, clip, run)
+            else:
+                clip = a(core, clip)
+                i += 1
+        return clip
+
+    @staticmethod
+    def resample(core, clip, run):
+        args = {}
+        sizes = [op for op in run if op[0] == 'resolution']
+        resamples = [op for op in run if op[0] == 'resample']
+        if sizes:
+            args['w'] = sizes[-1][1]
+            args['h'] = sizes[-1][2]
+            args['kernel'] = 'spline64'
+        if resamples:
+            css = resamples[-1][1]
+            args['css'] = css
+            args['csp'] = getattr(vs, f'YUV{css}P16')
+            args['fulls'] = resamples[-1][3]
+            fmt = clip.format
+            if not sizes and fmt.color_family == vs.YUV and fmt.sample_type == vs.INTEGER and fmt.bits_per_sample == 16 \
+               and (fmt.subsampling_w, fmt.subsampling_h) == {'420': (1, 1), '444': (0, 0)}[css]:
+                return clip
+        return core.fmtc.resample(clip, **args)
+
+
+def fuse_formats(named_tasks):
+    '''
+    Replace Format and Resolution tasks with FormatChain, adjacent ones share one chain.
+    '''
+    fused = []
+    for name, task in named_tasks:
+        if not isinstance(task, (Format, Resolution)):
+            fused.append((name, task))
+        elif fused and isinstance(fused[-1][1], FormatChain):
+            fused[-1][1].steps.append(task)
+            fused[-1] = (f'{fused[-1][0]}+{name}', fused[-1][1])
+        else:
+            fused.append((name, FormatChain([task])))
+    return fused
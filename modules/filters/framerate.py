@@ -1,5 +1,4 @@
 import vapoursynth as vs
-import functools
 import math
 import os
 
@@ -9,23 +8,38 @@ from .utils import ConfigureError, SimpleFilter, load_info
 def ChangeFPS(core, clip, _, fps_num, fps_den):
     return core.std.AssumeFPS(clip, fpsnum=fps_num, fpsden=fps_den)
 
+def frame_mapping(num_frames, fps_num, fps_den, target_fps_num, target_fps_den):
+    '''
+    Source frame of each output frame, when converting num_frames frames from
+    fps_num/fps_den to target_fps_num/target_fps_den by dropping or repeating frames.
+    '''
+    ratio = target_fps_num / target_fps_den * fps_den / fps_num
+    length = math.floor(num_frames * target_fps_num / target_fps_den * fps_den / fps_num)
+    return [min(math.floor(n / ratio), num_frames - 1) for n in range(length)]
+
 @SimpleFilter
 def FrameRate(core, clip, _, fps_num, fps_den):
-    source_clip = clip
-    target_fps_num = fps_num
-    target_fps_den = fps_den
-
-    def frame_adjuster(n, clip, target_fps_num, target_fps_den):
-        real_n = math.floor(n / (target_fps_num / target_fps_den * clip.fps_den / clip.fps_num))
-        one_frame_clip = clip[real_n] * (len(clip) + 100)
-        return one_frame_clip
-
-    attribute_clip = core.std.BlankClip(source_clip, length=math.floor(len(source_clip) * target_fps_num / target_fps_den * source_clip.fps_den / source_clip.fps_num), fpsnum=target_fps_num, fpsden=target_fps_den)
-    adjusted_clip = core.std.FrameEval(attribute_clip, functools.partial(frame_adjuster, clip=source_clip, target_fps_num=target_fps_num, target_fps_den=target_fps_den))
-    return core.std.AssumeFPS(adjusted_clip, fpsnum=target_fps_num, fpsden=target_fps_den)
+    mapping = frame_mapping(len(clip), clip.fps_num, clip.fps_den, fps_num, fps_den)
+    if not mapping:
+        raise ConfigureError('FrameRate: output clip has no frames')
+    # a single cycle covering the whole clip, offsets are the source frame of each output frame
+    adjusted_clip = core.std.SelectEvery(clip, cycle=len(clip), offsets=mapping)
+    return core.std.AssumeFPS(adjusted_clip, fpsnum=fps_num, fpsden=fps_den)
 
 @SimpleFilter
 def VFRToCFR(core, clip, _, fps_num, fps_den, drop_frames):
     info = load_info()
     timecode = os.path.join(info['temporary'], 'timecode.txt')
     return core.vfrtocfr.VFRToCFR(clip, timecodes=timecode, fpsnum=fps_num, fpsden=fps_den, drop=drop_frames)
+
+def test_frame_mapping():
+    # mapping of the previous FrameEval implementation, which selected clip[real_n] for output frame n
+    def frame_adjuster(n, num_frames, fps_num, fps_den, target_fps_num, target_fps_den):
+        return math.floor(n / (target_fps_num / target_fps_den * fps_den / fps_num))
+    rates = [(24000, 1001), (30000, 1001), (60000, 1001), (24, 1), (25, 1), (30, 1), (60, 1)]
+    for num_frames in [1, 2, 1000, 34046]:
+        for fps in rates:
+            for target_fps in rates:
+                mapping = frame_mapping(num_frames, *fps, *target_fps)
+                assert len(mapping) == math.floor(num_frames * target_fps[0] / target_fps[1] * fps[1] / fps[0])
+                assert mapping == [frame_adjuster(n, num_frames, *fps, *target_fps) for n in range(len(mapping))]
@@ -0,0 +1,95 @@
+import sys
+import vapoursynth as vs
+
+class Uncacheable(Exception):
+    pass
+
+def _key(value, refs):
+    # nodes and callables are keyed by identity, refs keeps them alive so ids are never reused
+    if isinstance(value, (vs.VideoNode, vs.AudioNode, vs.VideoFrame, vs.AudioFrame)) or callable(value):
+        refs.append(value)
+        return ('id', id(value))
+    if isinstance(value, (list, tuple)):
+        return ('list', tuple(_key(v, refs) for v in value))
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((k, _key(v, refs)) for k, v in value.items())))
+    if isinstance(value, vs.VideoFormat):
+        return ('format', value.id)
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        # 1, 1.0 and True must stay different arguments
+        return (type(value).__name__, value)
+    raise Uncacheable(type(value).__name__)
+
+def _is_nodes(value):
+    if isinstance(value, (list, tuple)):
+        return len(value) > 0 and all(_is_nodes(v) for v in value)
+    return isinstance(value, (vs.VideoNode, vs.AudioNode))
+
+class MemoFunction:
+    def __init__(self, memo, plugin, function):
+        self._memo = memo
+        self._name = f'{plugin}.{function.name}'
+        self._function = function
+
+    def __getattr__(self, name):
+        return getattr(self._function, name)
+
+    def __call__(self, *args, **kwargs):
+        refs = []
+        try:
+            key = (self._name, _key(args, refs), _key(kwargs, refs))
+        except Uncacheable:
+            return self._function(*args, **kwargs)
+        return self._memo.call(key, refs, self._function, args, kwargs)
+
+class MemoPlugin:
+    def __init__(self, memo, plugin):
+        self._memo = memo
+        self._plugin = plugin
+
+    def __getattr__(self, name):
+        attr = getattr(self._plugin, name)
+        if isinstance(attr, vs.Function):
+            return MemoFunction(self._memo, self._plugin.namespace, attr)
+        return attr
+
+class MemoCore:
+    '''
+    Proxy around the VapourSynth core that returns the node built earlier for
+    an identical plugin call (same function, same input nodes, same arguments),
+    so identical subgraphs are only computed and cached once.
+    Calls made through clip.namespace.Function() syntax are not seen by the proxy.
+    '''
+
+    def __init__(self, core):
+        object.__setattr__(self, '_core', core)
+        object.__setattr__(self, '_cache', {})
+        object.__setattr__(self, 'calls', 0)
+        object.__setattr__(self, 'hits', 0)
+
+    def __getattr__(self, name):
+        attr = getattr(self._core, name)
+        if isinstance(attr, vs.Plugin):
+            return MemoPlugin(self, attr)
+        return attr
+
+    def __setattr__(self, name, value):
+        setattr(self._core, name, value)
+
+    def call(self, key, refs, function, args, kwargs):
+        object.__setattr__(self, 'calls', self.calls + 1)
+        if key in self._cache:
+            object.__setattr__(self, 'hits', self.hits + 1)
+            return self._cache[key][0]
+        result = function(*args, **kwargs)
+        if _is_nodes(result):
+            self._cache[key] = (result, refs)
+        return result
+
+    def patch_modules(self):
+        '''
+        Scripts like mvsfunc keep the core in a module global, point those at the proxy too.
+        '''
+        for module in list(sys.modules.values()):
+            if module is not vs and getattr(module, 'core', None) is self._core:
+                module.core = self
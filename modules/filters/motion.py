@@ -0,0 +1,80 @@
+from third_party.vsdenoise import MVTools, Prefilter, SearchMode, MotionMode
+
+from .utils import ConfigureError, SimpleFilter
+from .format import resample_444p16
+
+# (clip id, analysis parameters) -> (clip, MVTools), the clip is kept so its id is never reused
+_analysed = {}
+# name -> MVTools, saved by StoreMotion
+_saved_motion = {}
+# clip id -> (clip, YUV444P16 clip), so filters on the same upstream clip analyse the same node
+_resampled = {}
+
+def _enum(enum, name):
+    if name not in enum.__members__:
+        raise ConfigureError(f'Motion: Unknown {enum.__name__} {name}')
+    return enum[name]
+
+def motion_clip(core, clip):
+    '''
+    clip in YUV444P16, the format the temporal denoisers and their vectors work on.
+    A single node per upstream clip, as get_motion shares vectors by node.
+    '''
+    if id(clip) not in _resampled:
+        _resampled[id(clip)] = (clip, resample_444p16(core, clip))
+    return _resampled[id(clip)][1]
+
+def get_motion(clip, tr=2, block_size=16, pel=2, refine=1, overlap=None, search='HEXAGON',
+               prefilter='NLMEANS', truemotion=False, hpad=None, vpad=None):
+    '''
+    Motion vectors of clip, analysed only once per clip node and parameters in a flow,
+    see motion_clip for getting the same node from the same upstream clip.
+    Vectors analysed with a larger temporal radius are reused for a smaller one.
+    '''
+    key = (id(clip), block_size, pel, refine, overlap, search, prefilter, truemotion, hpad, vpad)
+    if key in _analysed:
+        cached = _analysed[key][1]
+        if cached.tr == tr:
+            return cached
+        if cached.tr > tr and cached.vectors.vmulti is None:
+            return share_motion(cached, clip, tr)
+    mvtools = MVTools(
+        clip,
+        tr=tr,
+        refine=refine,
+        pel=pel,
+        hpad=hpad,
+        vpad=vpad,
+        prefilter=_enum(Prefilter, prefilter),
+        block_size=block_size,
+        overlap=overlap,
+        search=_enum(SearchMode, search),
+        motion=MotionMode.from_param(truemotion), )
+    mvtools.super()
+    mvtools.analyze()
+    _analysed[key] = (clip, mvtools)
+    return mvtools
+
+def share_motion(mvtools, clip, tr):
+    '''
+    A MVTools of clip using the vectors (and super clips, if built from clip) of mvtools.
+    '''
+    shared = MVTools(clip, tr=tr, refine=mvtools.refine, pel=mvtools.pel, hpad=mvtools.hpad, vpad=mvtools.vpad, vectors=mvtools)
+    shared.supers = mvtools.supers
+    return shared
+
+def load_motion(name, clip, tr):
+    if name not in _saved_motion:
+        raise ConfigureError(f"Motion vectors '{name}' not found.")
+    saved = _saved_motion[name]
+    if (saved.clip.width, saved.clip.height, saved.clip.num_frames) != (clip.width, clip.height, clip.num_frames):
+        raise ConfigureError(f"Motion vectors '{name}' were analysed on a clip of different size or length.")
+    if saved.tr < tr or (saved.tr > tr and saved.vectors.vmulti is not None):
+        raise ConfigureError(f"Motion vectors '{name}' have a temporal radius of {saved.tr}, {tr} is required.")
+    return share_motion(saved, clip, tr)
+
+@SimpleFilter
+def StoreMotion(core, clip, configure, name, **kwargs):
+    # analysed on the clip the temporal denoisers work on, the input is passed through
+    _saved_motion[name] = get_motion(motion_clip(core, clip), **kwargs)
+    return clip
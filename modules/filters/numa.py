@@ -0,0 +1,39 @@
+import os
+
+# no VapourSynth imports here, TreeDiagram uses these too
+
+def host_cpus():
+    '''
+    CPUs usable by this process.
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return os.sched_getaffinity(0)
+    return set(range(os.cpu_count() or 1))
+
+def parse_cpulist(cpulist):
+    cpus = set()
+    for part in cpulist.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+def numa_nodes():
+    '''
+    {NUMA node id: CPUs of the node usable by this process}, nodes without usable
+    CPUs are left out, a single node 0 on non-NUMA or non-Linux hosts.
+    '''
+    cpus = host_cpus()
+    nodes = {}
+    node_dir = '/sys/devices/system/node'
+    if os.path.isdir(node_dir):
+        for name in os.listdir(node_dir):
+            if not name.startswith('node') or not name[4:].isdigit():
+                continue
+            with open(os.path.join(node_dir, name, 'cpulist'), encoding='utf-8') as f:
+                node = parse_cpulist(f.read()) & cpus
+            if node:
+                nodes[int(name[4:])] = node
+    return dict(sorted(nodes.items())) or {0: cpus}
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import vapoursynth as vs
+
+from .utils import load_info, select_frames, select_by_props
+
+def detect_scenes(core, clip, threshold):
+    '''
+    A 1x1 GRAY8 clip, white on the first frame of each scene.
+    Detection runs on a downscaled luma plane, with misc.SCDetect when available.
+    Without akarin, the flags fall back to a FrameEval, a Python callback per frame.
+    '''
+    luma = core.std.ShufflePlanes(clip, 0, vs.GRAY)
+    small = core.resize.Bilinear(luma, width=max(clip.width // 8 // 2 * 2, 16), height=max(clip.height // 8 // 2 * 2, 16), format=vs.GRAY8)
+    if hasattr(core, 'misc'):
+        stats = core.misc.SCDetect(small, threshold=threshold)
+        expr = 'x._SceneChangePrev'
+        is_scene = lambda props: props['_SceneChangePrev'] == 1
+    else:
+        stats = core.std.PlaneStats(small, small[0] + small[:-1])
+        expr = f'x.PlaneStatsDiff {threshold} >'
+        is_scene = lambda props: props['PlaneStatsDiff'] > threshold
+    black = core.std.BlankClip(format=vs.GRAY8, width=1, height=1, length=clip.num_frames, color=0)
+    white = core.std.BlankClip(black, color=255)
+    # chosen by akarin.Select from the props, so the whole source is scanned without Python callbacks
+    return select_by_props(core, [black, white], stats, expr, lambda n, f: int(is_scene(f.props)))
+
+def load_scene_index():
+    path = os.path.join(load_info()['temporary'], 'scenechange.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def set_scene_props(core, clip, scenes):
+    starts = set(scenes)
+    variants = [
+        core.std.SetFrameProps(clip, _SceneChangePrev=prev, _SceneChangeNext=nxt)
+        for prev in (0, 1) for nxt in (0, 1)
+    ]
+    return select_frames(variants, lambda n: (n in starts) * 2 + (n + 1 in starts))
+
+class SceneChange:
+    '''
+    Marks the point of the flow where the scene change index is computed,
+    then sets _SceneChangePrev/_SceneChangeNext from the index on each frame.
+    '''
+    def __init__(self, _, threshold=0.1):
+        self.threshold = float(threshold)
+
+    def __call__(self, core, clip):
+        index = load_scene_index()
+        if index is None or index['frames'] != clip.num_frames:
+            print('SceneChange: No scene change index for this clip, frame props are left unchanged', file=sys.stderr)
+            return clip
+        return set_scene_props(core, clip, index['scenes'])
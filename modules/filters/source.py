@@ -1,8 +1,20 @@
 import sys
 
+import vapoursynth as vs
+
 from third_party import mvsfunc as mvf
 
-from .utils import ConfigureError, SimpleFilter, get_working_directory, merge_clips
+from .utils import ConfigureError, SimpleFilter, get_working_directory, merge_clips, load_info
+
+def to_yuv420p8(core, clip, range):
+    # most sources are already 4:2:0, the 16 bit round trip through fmtc.resample is skipped then
+    if clip.format.color_family != vs.YUV or clip.format.subsampling_w != 1 or clip.format.subsampling_h != 1:
+        clip = core.fmtc.resample(clip, css="420")
+    return mvf.Depth(clip, depth=8, fulls=range, fulld=False, dither=3)
+
+def index_file(filename):
+    # prebuilt by TreeDiagram into the cache directory, see sourceIndexes
+    return load_info().get('indexes', {}).get(filename)
 
 def SourceFilter(filter_func):
     @SimpleFilter
@@ -15,27 +27,29 @@ def SourceFilter(filter_func):
             message = 'Source: invalid range value: {}'.format(range)
             raise ConfigureError(message)
         file = get_working_directory(configure['source']['filename'])
-        clip = filter_func(core, file)
+        clip = filter_func(core, file, index_file(configure['source']['filename']))
         print('Source: Input clip info: format:'+clip.format.name+' width:'+str(clip.width)+' height:'+str(clip.height)+' num_frames:'+str(clip.num_frames)+' fps:'+str(clip.fps), file=sys.stderr)
-        clip = core.fmtc.resample(clip, css="420")
-        clip = mvf.Depth(clip, depth=8, fulls=range, fulld=False, dither=3)
-        return clip
+        return to_yuv420p8(core, clip, range)
     return source
 
 @SourceFilter
-def LWLibavSource(core, source):
+def LWLibavSource(core, source, cachefile):
+    if cachefile is not None:
+        return core.lsmas.LWLibavSource(source, cachefile=cachefile)
     return core.lsmas.LWLibavSource(source)
 
 @SourceFilter
-def LSMASHVideoSource(core, source):
+def LSMASHVideoSource(core, source, _):
     return core.lsmas.LSMASHVideoSource(source)
 
 @SourceFilter
-def FFmpegSource(core, source):
+def FFmpegSource(core, source, cachefile):
+    if cachefile is not None:
+        return core.ffms2.Source(source, cachefile=cachefile, seekmode=0)
     return core.ffms2.Source(source, seekmode=0)
 
 @SourceFilter
-def AVISource(core, source):
+def AVISource(core, source, _):
     return core.avisource.AVISource(source)
 
 @SimpleFilter
@@ -51,9 +65,12 @@ def MultiSource(core, clip, configure, source_filter, range):
         sf = core.avisource.AVISource
     else:
         raise ConfigureError(f'Source: Cannot find source filter: {source_filter}')
-    clips = [sf(get_working_directory(filename)) for filename in configure['source']['filenames']]
+    def open_source(filename):
+        cachefile = index_file(filename)
+        if cachefile is not None:
+            return sf(get_working_directory(filename), cachefile=cachefile)
+        return sf(get_working_directory(filename))
+    clips = [open_source(filename) for filename in configure['source']['filenames']]
     clip = merge_clips(clips)
     print('Source: Input clip info: format:'+clip.format.name+' width:'+str(clip.width)+' height:'+str(clip.height)+' num_frames:'+str(clip.num_frames)+' fps:'+str(clip.fps), file=sys.stderr)
-    clip = core.fmtc.resample(clip, css="420")
-    clip = mvf.Depth(clip, depth=8, fulls=range, fulld=False, dither=3)
-    return clip
+    return to_yuv420p8(core, clip, range)
@@ -1,4 +1,13 @@
-from .utils import ConfigureError, SimpleFilter, _saved_clips
+import os
+import sys
+import json
+import zlib
+import ctypes
+import hashlib
+import threading
+
+from .utils import ConfigureError, SimpleFilter, _saved_clips, load_info, get_working_directory
+from .digest import file_digest
 
 @SimpleFilter
 def StoreClip(core, clip, configure, name):
@@ -11,3 +20,118 @@ def LoadClip(core, clip, configure, name):
         raise ConfigureError(f"Clip '{name}' not found.")
     return _saved_clips[name]
 
+def write_frame(f, path, level=0):
+    '''
+    Write the planes and the scalar frame props of f into path, atomically.
+    The planes are compressed with zlib at level, if it is not 0.
+    '''
+    props = {k: v for k, v in f.props.items() if isinstance(v, (int, float, str))}
+    header = json.dumps({'props': props, 'zlib': level > 0}).encode('utf-8')
+    writing = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(writing, 'wb') as out:
+        out.write(len(header).to_bytes(4, 'little'))
+        out.write(header)
+        planes = b''.join(memoryview(f[p]).tobytes() for p in range(f.format.num_planes))
+        out.write(zlib.compress(planes, level) if level > 0 else planes)
+    os.replace(writing, path)
+
+def read_frame(f, path):
+    '''
+    A copy of f, of the same format and size, with the planes and props written by write_frame.
+    '''
+    fout = f.copy()
+    with open(path, 'rb') as src:
+        header = json.loads(src.read(int.from_bytes(src.read(4), 'little')))
+        planes = src.read()
+    if header['zlib']:
+        planes = zlib.decompress(planes)
+    pos = 0
+    for p in range(fout.format.num_planes):
+        height, width = memoryview(fout[p]).shape[:2]
+        row = width * fout.format.bytes_per_sample
+        data = bytearray(planes[pos:pos + row * height])
+        pos += row * height
+        if len(data) != row * height:
+            raise ConfigureError(f'Store: {path} is truncated')
+        buf = (ctypes.c_char * len(data)).from_buffer(data)
+        ptr = fout.get_write_ptr(p)
+        address = getattr(ptr, 'value', ptr)
+        stride = fout.get_stride(p)
+        if stride == row:
+            ctypes.memmove(address, buf, len(data))
+        else:
+            for y in range(height):
+                ctypes.memmove(address + y * stride, ctypes.addressof(buf) + y * row, row)
+    for k, v in header['props'].items():
+        fout.props[k] = v
+    return fout
+
+def disk_cached(core, clip, directory, level=0):
+    '''
+    clip with every rendered frame kept as a file in directory, so later requests,
+    in this or another process, read the file instead of running the graph again.
+    Every frame goes through Python callbacks (FrameEval, ModifyFrame) holding the GIL,
+    a few ms per frame at 1080p, so it only pays off in front of filters slower than that.
+    '''
+    if clip.format is None or clip.width == 0 or clip.height == 0:
+        raise ConfigureError('Store: Clips of variable format or size cannot be cached on disk')
+    os.makedirs(directory, exist_ok=True)
+    def path(n):
+        return os.path.join(directory, f'{n}.frame')
+    def save(n, f):
+        if not os.path.exists(path(n)):
+            write_frame(f, path(n), level)
+        return f
+    saving = core.std.ModifyFrame(clip, clip, save)
+    blank = core.std.BlankClip(clip)
+    loading = core.std.ModifyFrame(blank, blank, lambda n, f: read_frame(f, path(n)))
+    return core.std.FrameEval(clip, lambda n: loading if os.path.exists(path(n)) else saving)
+
+def referenced_files(conf):
+    '''
+    Files in the working directory named by the arguments of a flow step (logos, timecodes, scripts).
+    '''
+    if isinstance(conf, dict):
+        return [f for v in conf.values() for f in referenced_files(v)]
+    if isinstance(conf, list):
+        return [f for v in conf for f in referenced_files(v)]
+    if isinstance(conf, str) and os.path.isfile(get_working_directory(conf, is_exists=False)):
+        return [conf]
+    return []
+
+class CheckpointClip:
+    '''
+    Frames of the flow up to this step are kept losslessly in the cache directory, keyed by
+    the content of the source files, the flow before this step and the files it names,
+    so a later run (or another process of a chunked encode) reads them back instead of
+    running the flow again.
+    Frames are served through disk_cached, paying its per-frame Python cost, place it after
+    the slow part of the flow.
+    '''
+    def __init__(self, configure, name='checkpoint', compression=1):
+        flow = [step if isinstance(step, dict) else {step: {}} for step in configure['project']['flow']]
+        def step_name(conf):
+            if isinstance(conf, dict):
+                return conf.get('name', 'checkpoint')
+            if isinstance(conf, list):
+                return conf[0] if conf else 'checkpoint'
+            return conf or 'checkpoint'
+        positions = [idx for idx, step in enumerate(flow)
+                     if list(step)[0] == 'CheckpointClip' and step_name(list(step.values())[0]) == name]
+        if len(positions) != 1:
+            raise ConfigureError(f"CheckpointClip: Checkpoint name '{name}' must be used exactly once in the flow")
+        prefix = flow[:positions[0]]
+        source = {k: v for k, v in configure['source'].items() if k != 'subtitle'}
+        filenames = [f for f in [source.get('filename')] + list(source.get('filenames') or []) if f]
+        filenames += [f for step in prefix for f in referenced_files(list(step.values())[0]) if f not in filenames]
+        files = [[filename, file_digest(get_working_directory(filename))] for filename in filenames]
+        key = json.dumps({'source': source, 'files': files, 'flow': prefix, 'name': name}, sort_keys=True)
+        self.key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        self.name = name
+        self.compression = compression
+
+    def __call__(self, core, clip):
+        directory = os.path.join(load_info()['cache'], 'checkpoints', self.key)
+        cached = len([f for f in os.listdir(directory) if f.endswith('.frame')]) if os.path.isdir(directory) else 0
+        print(f'CheckpointClip: {self.name}: {cached} of {clip.num_frames} frames cached in {directory}', file=sys.stderr)
+        return disk_cached(core, clip, directory, self.compression)
@@ -1,15 +1,49 @@
+import os
+import sys
+import json
 import time
 
 from third_party import mvsfunc as mvf
 
-from .utils import SimpleFilter, ConfigureError, get_working_directory, merge_clips
+from .utils import SimpleFilter, ConfigureError, get_working_directory, merge_clips, merge_ranges, splice_ranges, load_info
+
+
+def subtitle_ranges(clip, file):
+    '''
+    Frame ranges of clip covered by subtitle events, exported by TreeDiagram before
+    processing video. Returns None when they are unknown, the whole clip is rendered then.
+    '''
+    events = os.path.join(load_info()['temporary'], 'subtitle_events.json')
+    if not os.path.exists(events) or clip.fps_num == 0:
+        return None
+    with open(events, encoding='utf-8') as f:
+        events = json.load(f)
+    if events['filename'] != file:
+        return None
+    ranges = []
+    for start, end in events['events']:
+        # frame n is shown at n * fps_den / fps_num seconds, keep one frame of margin for rounding
+        first = -(-start * clip.fps_num // (clip.fps_den * 1000)) - 1
+        last = -(-end * clip.fps_num // (clip.fps_den * 1000))
+        first = max(first, 0)
+        last = min(last, clip.num_frames - 1)
+        if first <= last:
+            ranges.append([first, last])
+    ranges = merge_ranges(ranges)
+    rendered = sum(last - first + 1 for first, last in ranges)
+    print(f'Subtitle: {rendered} of {clip.num_frames} frames have events', file=sys.stderr)
+    return ranges
 
 
 @SimpleFilter
 def VSFilterMod(core, clip, configure):
     subtitle = configure['source']['subtitle']
     file = get_working_directory(subtitle['filename'])
-    return core.vsfm.TextSubMod(clip, file)
+    rendered = core.vsfm.TextSubMod(clip, file)
+    ranges = subtitle_ranges(clip, file)
+    if ranges is None:
+        return rendered
+    return splice_ranges(clip, rendered, ranges)
 
 
 @SimpleFilter
@@ -23,7 +57,11 @@ def Subtext(core, clip, configure):
     for index in range(2):
         yuv = mvf.ToYUV(rendered[index], css="444", full=False)
         subtext.append(mvf.Depth(yuv, depth=16, fulls=False, fulld=False, dither=3))
-    return core.std.MaskedMerge(clipa=clip, clipb=subtext[0], mask=subtext[1])
+    merged = core.std.MaskedMerge(clipa=clip, clipb=subtext[0], mask=subtext[1])
+    ranges = subtitle_ranges(clip, file)
+    if ranges is None:
+        return merged
+    return splice_ranges(clip, merged, ranges)
 
 
 @SimpleFilter
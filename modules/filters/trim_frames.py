@@ -1,4 +1,4 @@
-from .utils import ConfigureError, merge_clips, get_working_directory
+from .utils import ConfigureError, trim_ranges, get_working_directory
 import os
 import sys
 import subprocess
@@ -13,9 +13,5 @@ class TrimFrames:
         self.frames = frames
 
     def __call__(self, core, clip):
-        clips = [
-            core.std.Trim(clip, first=first, last=last)
-            for first, last in self.frames
-        ]
-        return merge_clips(clips)
+        return trim_ranges(clip, self.frames)
 
@@ -2,8 +2,10 @@ import os
 import sys
 import json
 import inspect
+import vapoursynth as vs
 
 _saved_clips = {}
+_constant_clips = {}
 _info = None
 
 class ConfigureError(Exception):
@@ -30,10 +32,81 @@ def get_working_directory(*paths, is_exists=True):
     return os.path.realpath(path)
 
 def merge_clips(clips):
-    clip = clips[0]
-    for item in clips[1:]:
-        clip += item
-    return clip
+    if len(clips) == 1:
+        return clips[0]
+    return vs.core.std.Splice(clips)
+
+def merge_ranges(ranges):
+    '''
+    Sort [first, last] pairs (both inclusive), merging overlapping and adjacent ones.
+    '''
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+def trim_ranges(clip, ranges):
+    '''
+    Keep frames inside ranges, in the given order.
+    '''
+    return merge_clips([clip[first:last + 1] for first, last in ranges])
+
+def select_frames(clips, decide):
+    '''
+    Take frame n from clips[decide(n)]. decide runs for every frame while the
+    graph is built, rendering is a single Splice of Trims without any Python callback.
+    '''
+    num_frames = clips[0].num_frames
+    if num_frames == 0:
+        return clips[0]
+    segments = []
+    first = 0
+    current = decide(0)
+    for n in range(1, num_frames + 1):
+        index = decide(n) if n < num_frames else None
+        if index != current:
+            segments.append(clips[current][first:n])
+            first = n
+            current = index
+    return merge_clips(segments)
+
+def splice_ranges(clip, processed, ranges):
+    '''
+    Take frames inside ranges from processed and all other frames from clip.
+    ranges are sorted, disjoint [first, last] pairs (both inclusive).
+    '''
+    clips = []
+    pos = 0
+    for first, last in ranges:
+        if first > pos:
+            clips.append(clip[pos:first])
+        clips.append(processed[first:last + 1])
+        pos = last + 1
+    if pos < clip.num_frames:
+        clips.append(clip[pos:])
+    return merge_clips(clips)
+
+def constant_clip(key, build, length):
+    '''
+    A clip of length frames all showing the single frame clip returned by build().
+    build runs once per key, so key should cover everything the frame depends on
+    (usually the format and size).
+    '''
+    if key not in _constant_clips:
+        _constant_clips[key] = build()
+    return _constant_clips[key].std.Loop(times=length)
+
+def select_by_props(core, clips, prop_src, expr, decide):
+    '''
+    Per frame choice depending on frame props, with akarin.Select when it is
+    loaded. expr and decide(n, f) must agree, decide is the FrameEval fallback.
+    '''
+    if hasattr(core, 'akarin'):
+        return core.akarin.Select(clips, prop_src, expr)
+    return core.std.FrameEval(clips[0], lambda n, f: clips[decide(n, f)], prop_src=prop_src)
 
 def load_clip(name):
     if name not in _saved_clips:
@@ -0,0 +1,33 @@
+import os
+import sys
+import vapoursynth
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from filters.plugins import load_plugins
+from filters.utils import ConfigureError
+
+def main():
+    '''
+    Build the index of a source into cachefile, arguments are given by vspipe --arg.
+    '''
+    source_filter, source, cachefile = (globals()[k] for k in ['source_filter', 'source', 'cachefile'])
+
+    core = vapoursynth.core
+    load_plugins(core)
+
+    print(f'Index: Indexing {source} with {source_filter}', file=sys.stderr)
+    if source_filter == 'LWLibavSource':
+        clip = core.lsmas.LWLibavSource(source, cachefile=cachefile)
+    elif source_filter in ['FFmpegSource', 'FFMS2Source']:
+        core.ffms2.Index(source, cachefile=cachefile)
+        clip = core.ffms2.Source(source, cachefile=cachefile, seekmode=0)
+    else:
+        raise ConfigureError(f'Index: {source_filter} does not build an index')
+    print(f'Index: {clip.num_frames} frames indexed into {cachefile}', file=sys.stderr)
+    clip.set_output()
+
+
+if __name__ == '__vapoursynth__':
+    main()
@@ -1,6 +1,8 @@
+import csv
 import json
 import os
 import sys
+import time
 import vapoursynth
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -9,8 +11,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from filters.plugins import load_plugins
 from filters.utils import load_info
 from filters.utils import ConfigureError
+from filters.numa import host_cpus, numa_nodes
 
-def make_tasks(configure):
+def make_named_tasks(configure):
     # pylint: disable=import-outside-toplevel
     import filters
 
@@ -22,35 +25,232 @@ def make_tasks(configure):
         if len(step) != 1:
             raise ConfigureError('Core: Less/More than one config in a single step, forgot \'-\' ?')
         filter_name = list(step)[0]
-        if not hasattr(filters, filter_name):
+        filter_class = filters.get_filter(filter_name)
+        if filter_class is None:
             raise ConfigureError(f'Core: Filter {filter_name} not found')
         filter_conf = step[filter_name]
         print(f'Core: Add External filter: {filter_name}', file=sys.stderr)
         if isinstance(filter_conf, list):
-            tasks.append(getattr(filters, filter_name)(configure, *filter_conf))
+            tasks.append((filter_name, filter_class(configure, *filter_conf)))
         elif isinstance(filter_conf, dict):
-            tasks.append(getattr(filters, filter_name)(configure, **filter_conf))
+            tasks.append((filter_name, filter_class(configure, **filter_conf)))
         else:
-            tasks.append(getattr(filters, filter_name)(configure, filter_conf))
+            tasks.append((filter_name, filter_class(configure, filter_conf)))
+    if configure['project'].get('optimize_flow', True) and \
+       any(name in ('Format', 'Resolution') for name, _ in tasks):
+        from filters.format import fuse_formats
+        tasks = fuse_formats(tasks)
     return tasks
 
-def main():
+def make_tasks(configure):
+    return [task for _, task in make_named_tasks(configure)]
+
+def peak_rss():
+    if sys.platform == 'win32':
+        return None
+    # pylint: disable=import-outside-toplevel
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def profile_tasks(core, named_tasks, profile, temporary):
+    '''
+    Render a sample of frames after each step of the flow, and attribute the
+    wall time, CPU time and memory used to that step.
+    Each step samples different frames, so the time of a step is the cost of the
+    whole prefix minus the cost measured at the previous step.
+    '''
+    if not isinstance(profile, dict):
+        profile = {}
+    num_samples = profile.get('frames', 32)
+    node_timing = profile.get('node_timing', False) and hasattr(core, 'node_timing')
+    if node_timing:
+        core.node_timing = True
+    report = []
+    last_wall = 0.0
+    last_cpu = 0.0
+    clip = None
+    for idx, (name, task) in enumerate(named_tasks):
+        clip = task(core, clip)
+        if clip.num_frames == 0 or num_samples <= 0:
+            print(f'Profile: step {idx} {name}: no frames to sample, not profiled', file=sys.stderr)
+            continue
+        stride = max(clip.num_frames // num_samples, 1)
+        samples = sorted({(n * stride + idx * 37) % clip.num_frames for n in range(min(num_samples, clip.num_frames))})
+        sampled = core.std.Splice([clip[n] for n in samples]) if len(samples) > 1 else clip[samples[0]]
+        if node_timing:
+            # time spent in the filter producing the output of this step, in nanoseconds
+            clip.timings = 0
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for f in [sampled.get_frame_async(n) for n in range(sampled.num_frames)]:
+            f.result()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        result = {
+            'step': idx,
+            'filter': name,
+            'frames': len(samples),
+            'wall_time': wall,
+            'cpu_time': cpu,
+            'step_wall_time': max(wall - last_wall, 0.0),
+            'step_cpu_time': max(cpu - last_cpu, 0.0),
+            'peak_rss': peak_rss(),
+            'used_framebuffer_size': getattr(core.core_info, 'used_framebuffer_size', None) if hasattr(core, 'core_info') else None,
+            'vs_node_time': clip.timings / 1e9 if node_timing else None,
+        }
+        last_wall = wall
+        last_cpu = cpu
+        report.append(result)
+        print(f'Profile: step {idx} {name}: {result["step_wall_time"] * 1000 / len(samples):.1f} ms/frame wall, '
+              f'{result["step_cpu_time"] * 1000 / len(samples):.1f} ms/frame cpu', file=sys.stderr)
+    with open(os.path.join(temporary, 'profile.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps(report, indent=2))
+    with open(os.path.join(temporary, 'profile.csv'), 'w', encoding='utf-8', newline='') as f:
+        if report:
+            writer = csv.DictWriter(f, fieldnames=list(report[0]))
+            writer.writeheader()
+            writer.writerows(report)
+    return clip
+
+def test_profile_node_timing():
+    # pylint: disable=import-outside-toplevel
+    import tempfile
+    core = vapoursynth.core
+    if not hasattr(core, 'node_timing'):
+        return
+    named_tasks = [
+        ('Source', lambda core, _: core.std.BlankClip(format=vapoursynth.YUV420P8, width=640, height=360, length=100)),
+        ('Blur', lambda core, clip: core.std.BoxBlur(clip, hradius=8, vradius=8)),
+    ]
+    with tempfile.TemporaryDirectory() as temporary:
+        profile_tasks(core, named_tasks, {'frames': 8, 'node_timing': True}, temporary)
+        with open(os.path.join(temporary, 'profile.json'), encoding='utf-8') as f:
+            report = json.load(f)
+    assert [r['filter'] for r in report] == ['Source', 'Blur']
+    assert all(r['vs_node_time'] is not None for r in report)
+    assert report[1]['vs_node_time'] > 0
+
+def available_memory():
+    '''
+    Available physical memory in bytes, None if unknown.
+    '''
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo', encoding='utf-8') as f:
+            for l in f:
+                if l.startswith('MemAvailable:'):
+                    return int(l.split()[1]) * 1024
+    elif sys.platform == 'win32':
+        # pylint: disable=import-outside-toplevel
+        import ctypes
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    return None
+
+def auto_threads(jobs):
+    '''
+    Split the usable CPUs among concurrent jobs, without letting a job
+    straddle NUMA nodes once there are at least as many jobs as nodes.
+    '''
+    cpus = host_cpus()
+    nodes = list(numa_nodes().values())
+    if len(nodes) > 1 and jobs >= len(nodes):
+        jobs_per_node = -(-jobs // len(nodes))
+        return max(min(len(n) for n in nodes) // jobs_per_node, 1)
+    return max(len(cpus) // jobs, 1)
+
+def auto_cache_size(jobs):
+    '''
+    Half of the available memory of each job, in MB. The other half is left
+    for frames in flight, plugins and the encoder.
+    '''
+    memory = available_memory()
+    if memory is None:
+        return None
+    return max(memory // jobs // 2 // 1048576, 1024)
+
+def calibrate_threads(core, clip, threads, frames):
+    '''
+    Render a few frames with some thread counts up to threads, returns the fastest.
+    Each candidate renders different frames, so the frame cache does not skew the result.
+    '''
+    candidates = sorted({max(threads // 2, 1), max(threads * 3 // 4, 1), threads})
+    best = threads
+    best_fps = 0.0
+    for idx, candidate in enumerate(candidates):
+        core.num_threads = candidate
+        stride = max(clip.num_frames // len(candidates) // frames, 1)
+        first = clip.num_frames * idx // len(candidates)
+        samples = [min(first + n * stride, clip.num_frames - 1) for n in range(frames)]
+        start = time.perf_counter()
+        for f in [clip.get_frame_async(n) for n in samples]:
+            f.result()
+        fps = frames / (time.perf_counter() - start)
+        print(f'Core: Calibration: {candidate} threads, {fps:.2f} fps', file=sys.stderr)
+        if fps > best_fps:
+            best = candidate
+            best_fps = fps
+    core.num_threads = best
+    return best
+
+def build_output(proxy=None, clipinfo_path=None):
+    '''
+    Build the flow and return the node to be rendered, which is what vspipe outputs.
+    proxy(core, clip) is applied to the clip of the first step (the source), see preview.py.
+    The output clip info is written into clipinfo_path, temporary/clipinfo.json by default.
+    '''
 
     environment = load_info()
     configure = environment['content']
     performance = configure['project']['performance']
 
     core = vapoursynth.core
-    core.num_threads = performance['vs_threads']
-    core.max_cache_size = performance['vs_max_cache_size']
+    jobs = performance.get('concurrent_jobs', 1)
+    threads = performance['vs_threads']
+    if threads == 'auto':
+        threads = auto_threads(jobs)
+    core.num_threads = threads
+    cache_size = performance['vs_max_cache_size']
+    if cache_size == 'auto':
+        cache_size = auto_cache_size(jobs)
+    if cache_size is not None:
+        core.max_cache_size = cache_size
+    print(f'Core: vs_threads: {core.num_threads}, vs_max_cache_size: {core.max_cache_size} MB, concurrent_jobs: {jobs}', file=sys.stderr)
 
     load_plugins(core)
 
-    clip = None
-    for task in make_tasks(configure):
-        clip = task(core, clip)
+    named_tasks = make_named_tasks(configure)
+    if proxy is not None:
+        name, source = named_tasks[0]
+        named_tasks[0] = (name, lambda core, clip: proxy(core, source(core, clip)))
+    if performance.get('memoize'):
+        # pylint: disable=import-outside-toplevel
+        from filters.memo import MemoCore
+        core = MemoCore(core)
+        core.patch_modules()
+    if performance.get('profile'):
+        clip = profile_tasks(core, named_tasks, performance['profile'], environment['temporary'])
+    else:
+        clip = None
+        for _, task in named_tasks:
+            clip = task(core, clip)
+    if performance.get('vs_calibrate'):
+        frames = performance['vs_calibrate']
+        if isinstance(frames, bool):
+            frames = 16
+        threads = calibrate_threads(core, clip, threads, frames)
+        print(f'Core: vs_threads calibrated to {threads}', file=sys.stderr)
+    if performance.get('memoize'):
+        print(f'Core: Memoize: {core.hits} of {core.calls} filter calls reused an existing node', file=sys.stderr)
     print('Core: Output clip info: format:'+clip.format.name+' width:'+str(clip.width)+' height:'+str(clip.height)+' num_frames:'+str(clip.num_frames)+' fps:'+str(clip.fps), file=sys.stderr)
-    file = open(os.path.join(environment['temporary'], 'clipinfo.json'), 'w', encoding='utf-8')
+    file = open(clipinfo_path or os.path.join(environment['temporary'], 'clipinfo.json'), 'w', encoding='utf-8')
     clipinfo = {
         "format": clip.format.name,
         "resolution": [clip.width, clip.height],
@@ -60,8 +260,11 @@ def main():
     data = json.dumps(clipinfo)
     file.write(data)
     file.close()
-    video = core.resize.Point(clip, matrix_in_s="709")
-    video.set_output()
+    return core.resize.Point(clip, matrix_in_s="709")
+
+def main():
+    # vspipe --arg clipinfo=... gives another path, for segments rendered concurrently
+    build_output(clipinfo_path=globals().get('clipinfo')).set_output()
 
 
 if __name__ == '__vapoursynth__':
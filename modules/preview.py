@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import hashlib
+import vapoursynth
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from filters.utils import load_info, trim_ranges, get_working_directory, ConfigureError
+from filters.store import disk_cached
+from misaka64 import build_output
+
+def make_proxy(scale):
+    '''
+    The source downscaled by scale, filters working in absolute pixels (Crop, Delogo) see the proxy.
+    '''
+    def proxy(core, clip):
+        width = max(round(clip.width * scale / 4) * 4, 4)
+        height = max(round(clip.height * scale / 4) * 4, 4)
+        return core.resize.Bicubic(clip, width, height)
+    return proxy
+
+def preview_key(configure, preview):
+    '''
+    Frames of a preview depend on the source file, the flow and the proxy settings.
+    '''
+    stat = os.stat(get_working_directory(configure['source'].get('filename') or configure['source']['filenames'][0]))
+    key = json.dumps({
+        'source': configure['source'],
+        'stat': [stat.st_size, stat.st_mtime_ns],
+        'flow': configure['project']['flow'],
+        'scale': preview.get('scale', 1),
+        'sample_every': preview.get('sample_every', 1),
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def main():
+    '''
+    The flow for vsedit, on a proxy of the source and a subset of the frames,
+    with rendered frames cached on disk, configured by project.preview:
+        scale: 0.5          # downscale the source
+        sample_every: 4     # keep every 4th frame of the output
+        frames: [[1000, 1199], 5000]  # frames to preview after sampling, ranges are inclusive
+        cache: true         # keep rendered frames in the cache directory
+    '''
+    environment = load_info()
+    configure = environment['content']
+    preview = configure['project'].get('preview') or {}
+    scale = preview.get('scale', 1)
+    sample_every = preview.get('sample_every', 1)
+    video = build_output(make_proxy(scale) if scale != 1 else None)
+    if sample_every > 1:
+        # sampled on the output, so TrimFrames, Delogo and others still see the frame numbers of the source,
+        # and only the sampled frames are rendered through the flow
+        video = video[::sample_every]
+    core = vapoursynth.core
+    if preview.get('cache', True):
+        directory = os.path.join(environment['cache'], 'preview', preview_key(configure, preview))
+        print(f'Preview: Rendered frames are cached in {directory}', file=sys.stderr)
+        video = disk_cached(core, video, directory)
+    if preview.get('frames'):
+        ranges = [r if isinstance(r, list) else [r, r] for r in preview['frames']]
+        ranges = [[first, min(last, video.num_frames - 1)] for first, last in ranges if first < video.num_frames]
+        if not ranges:
+            raise ConfigureError(f'Preview: No frames to preview, the output has {video.num_frames} frames')
+        video = trim_ranges(video, ranges)
+    print(f'Preview: scale {scale}, every {sample_every} frame(s), {video.num_frames} frames to preview', file=sys.stderr)
+    video.set_output()
@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+import threading
+import vapoursynth as vs
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from third_party import mvsfunc as mvf
+from third_party import muvsfunc as muf
+from filters.plugins import load_plugins
+from filters.utils import load_info
+from misaka64 import make_named_tasks
+
+def reference_clip(core, configure, reference):
+    '''
+    The clip the encoded frames are compared with: 'source' is the flow up to
+    TrimFrames (or the source step alone), 'output' is the whole flow.
+    '''
+    named_tasks = make_named_tasks(configure)
+    names = [name for name, _ in named_tasks]
+    if reference == 'output':
+        end = len(named_tasks)
+    else:
+        end = names.index('TrimFrames') + 1 if 'TrimFrames' in names else 1
+    clip = None
+    for _, task in named_tasks[:end]:
+        clip = task(core, clip)
+    return clip
+
+def main():
+    '''
+    Compare sampled frames of the encoded video (given by vspipe --arg encoded=...) with
+    the reference, aligned by frame number. PSNR and SSIM of every plane are written to
+    temporary/qc.jsonl, a line per frame, as the frames are rendered in parallel.
+    '''
+    environment = load_info()
+    configure = environment['content']
+    qc = configure['project'].get('qc') or {}
+    if not isinstance(qc, dict):
+        qc = {}
+    encoded_path = globals()['encoded']
+    results = os.path.join(environment['temporary'], 'qc.jsonl')
+
+    core = vs.core
+    load_plugins(core)
+
+    reference = reference_clip(core, configure, qc.get('reference', 'source'))
+    encoded = core.lsmas.LWLibavSource(encoded_path)
+    count = min(qc.get('frames', 200), encoded.num_frames)
+    error = None
+    if reference.num_frames != encoded.num_frames:
+        error = f'reference has {reference.num_frames} frames, encoded video has {encoded.num_frames}'
+    elif count <= 0:
+        error = f'no frames to compare, encoded video has {encoded.num_frames} frames, {qc.get("frames", 200)} sampled'
+    if error is not None:
+        with open(results, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'error': error}) + '\n')
+        core.std.BlankClip(format=vs.GRAY8, width=1, height=1, length=1).set_output()
+        return
+    if (reference.width, reference.height, reference.format.id) != (encoded.width, encoded.height, encoded.format.id):
+        reference = core.resize.Bicubic(reference, encoded.width, encoded.height, format=encoded.format.id)
+
+    samples = [n * encoded.num_frames // count for n in range(count)]
+    encoded = core.std.Splice([encoded[n] for n in samples]) if count > 1 else encoded[samples[0]]
+    reference = core.std.Splice([reference[n] for n in samples]) if count > 1 else reference[samples[0]]
+
+    measured = []
+    for plane in range(encoded.format.num_planes):
+        measured.append(mvf.PlaneCompare(encoded, reference, plane=plane, mae=False, rmse=False, cov=False, corr=False))
+        measured.append(muf.SSIM(encoded, reference, plane=plane))
+
+    lock = threading.Lock()
+    out = open(results, 'w', encoding='utf-8')
+    recorded = set()
+    def record(n, f):
+        planes = [{'psnr': f[1 + p * 2].props['PlanePSNR'], 'ssim': f[2 + p * 2].props['PlaneSSIM']}
+                  for p in range(len(measured) // 2)]
+        with lock:
+            if n not in recorded:
+                recorded.add(n)
+                out.write(json.dumps({'frame': samples[n], 'planes': planes}) + '\n')
+                out.flush()
+                # closed after the last frame, vspipe exits without running finalizers
+                if len(recorded) == count:
+                    out.close()
+        return f[0]
+    blank = core.std.BlankClip(format=vs.GRAY8, width=1, height=1, length=count)
+    print(f'QC: Comparing {count} frames with the {qc.get("reference", "source")} clip', file=sys.stderr)
+    core.std.ModifyFrame(blank, [blank] + measured, record).set_output()
+
+
+if __name__ == '__vapoursynth__':
+    main()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+import third_party # puts the vendored packages on sys.path
+from vstools import clip_async_render
+from filters.utils import load_info
+from misaka64 import build_output
+
+def main():
+    '''
+    Render the flow as y4m into stdout in this process, in place of vspipe.
+    The y4m stream is written by VapourSynth itself, like vspipe -c y4m does.
+    '''
+    performance = load_info()['content']['project']['performance']
+    video = build_output()
+    # 0 lets VapourSynth keep as many requests in flight as it has threads
+    requests = performance.get('render_requests', 0)
+    progress = 'Render' if sys.stderr.isatty() else None
+    print(f'Render: {video.num_frames} frames, {requests or "auto"} requests in flight', file=sys.stderr)
+    clip_async_render(video, sys.stdout.buffer, progress, prefetch=requests, y4m=True)
+    sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main()
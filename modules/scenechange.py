@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import vapoursynth
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# pylint: disable=wrong-import-position
+from filters.plugins import load_plugins
+from filters.utils import load_info
+from filters.utils import ConfigureError
+from filters.scene import detect_scenes
+from misaka64 import make_named_tasks
+
+def main():
+
+    environment = load_info()
+    configure = environment['content']
+
+    core = vapoursynth.core
+    load_plugins(core)
+
+    named_tasks = make_named_tasks(configure)
+    names = [name for name, _ in named_tasks]
+    if 'SceneChange' not in names:
+        raise ConfigureError('SceneChange: SceneChange is not in the flow')
+    position = names.index('SceneChange')
+    clip = None
+    for _, task in named_tasks[:position]:
+        clip = task(core, clip)
+    prefix = clip
+    for _, task in named_tasks[position:]:
+        clip = task(core, clip)
+    print(f'SceneChange: Analysing {prefix.num_frames} frames, output has {clip.num_frames} frames', file=sys.stderr)
+    with open(os.path.join(environment['temporary'], 'scenechange_clipinfo.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'frames': prefix.num_frames,
+            'output_frames': clip.num_frames,
+        }))
+    detect_scenes(core, prefix, named_tasks[position][1].threshold).set_output()
+
+
+if __name__ == '__vapoursynth__':
+    main()
@@ -4,6 +4,8 @@
 from .precheck import precheck, info
 precheck()
 from .procedure import main, loadCurrentWorking, missionReport, precheckOutput, precheckSubtitle, \
-    precleanTemporaryFiles, processVideo, processAudio, mkvMerge, mkvMetainfo, cleanTemporaryFiles, \
+    precleanTemporaryFiles, processVideo, qualityCheck, processAudio, mkvMerge, mkvMetainfo, cleanTemporaryFiles, \
     missionComplete, runMission, syncContent, genVseditFile, genVsedit
 from .kit import ExitException
+from .audio_bench import benchAudio
+from .pipe_bench import benchPipe
@@ -7,6 +7,10 @@ from .. import tree_diagram # pylint: disable=relative-beyond-top-level
 try:
     if len(sys.argv) >= 2 and sys.argv[1] == 'vsedit':
         tree_diagram.genVsedit()
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'bench-audio':
+        tree_diagram.benchAudio(sys.argv[2:])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'bench-pipe':
+        tree_diagram.benchPipe(sys.argv[2:])
     else:
         tree_diagram.main()
 except tree_diagram.ExitException as e:
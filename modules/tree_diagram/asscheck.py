@@ -1,35 +1,205 @@
 #!/usr/bin/env python3
 
 import re
+import os
+import json
+import hashlib
+import logging
 import subprocess
-from typing import List
+from typing import List, Optional, Set
 from . import info
 
+logger = logging.getLogger('tree_diagram')
+
+fontconfig_cache_dirs = [
+    os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'fontconfig'),
+    os.path.expanduser('~/.fontconfig'),
+    '/var/cache/fontconfig',
+    '/usr/lib/fontconfig/cache',
+]
+
+font_index = None
+font_index_fresh = False
+
+ass_cache = {}
+hash_cache = {}
+override_block = re.compile(r'{([^{}]*)}')
+default_style_format = ['name', 'fontname']
+default_event_format = ['layer', 'start', 'end', 'style', 'name', 'marginl', 'marginr', 'marginv', 'effect', 'text']
+
+def fileHash(filename: str) -> str:
+    stat = os.stat(filename)
+    key = (os.path.realpath(filename), stat.st_size, stat.st_mtime)
+    if key not in hash_cache:
+        h = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        hash_cache[key] = h.hexdigest()
+    return hash_cache[key]
+
+def parseAssTime(t: str) -> int:
+    h, m, s = t.strip().split(':')
+    return round((int(h) * 3600 + int(m) * 60 + float(s)) * 1000)
+
+def mergeRanges(ranges: List[List[int]]) -> List[List[int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def parseAssOverrides(text: str, fonts: Set[str], resets: Set[str]) -> None:
+    for block in override_block.findall(text):
+        for tag in block.split('\\')[1:]:
+            if tag.startswith('fn'):
+                fontname = tag[2:].strip()
+                if fontname:
+                    fonts.add(fontname)
+            elif tag.startswith('r') and not tag.startswith('rnd'): # \rnd* are VSFilterMod tags
+                style = tag[1:].strip()
+                if style:
+                    resets.add(style)
+
+def parseAss(filename: str) -> dict:
+    '''
+    Streaming parser for SSA/ASS files, honours the Format lines of styles and events.
+    Results are cached by file hash, so checking and rendering the same subtitle
+    parses it only once.
+
+    Returns a dict with:
+      styles: style name -> font name
+      used_styles: styles referenced by dialogue lines or \\r resets
+      fonts: fonts of used styles and inline \\fn overrides
+      events: merged [start, end) ranges of dialogue lines, in milliseconds
+    '''
+    digest = fileHash(filename)
+    if digest in ass_cache:
+        return ass_cache[digest]
+    styles = {}
+    used_styles = set()
+    fonts = set()
+    events = []
+    section = None
+    style_format = default_style_format
+    event_format = default_event_format
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        for l in f:
+            l = l.strip()
+            if l.startswith('[') and l.endswith(']'):
+                section = l.lower()
+                continue
+            key, sep, value = l.partition(':')
+            if not sep:
+                continue
+            key = key.strip().lower()
+            if section in ('[v4+ styles]', '[v4 styles]'):
+                if key == 'format':
+                    style_format = [v.strip().lower() for v in value.split(',')]
+                elif key == 'style':
+                    fields = value.split(',')
+                    if len(fields) < len(style_format):
+                        continue
+                    fields = dict(zip(style_format, fields))
+                    styles[fields['name'].strip().lstrip('*')] = fields['fontname'].strip()
+            elif section == '[events]':
+                if key == 'format':
+                    event_format = [v.strip().lower() for v in value.split(',')]
+                elif key == 'dialogue':
+                    fields = value.split(',', len(event_format) - 1)
+                    if len(fields) != len(event_format):
+                        continue
+                    fields = dict(zip(event_format, fields))
+                    try:
+                        start, end = parseAssTime(fields['start']), parseAssTime(fields['end'])
+                    except ValueError:
+                        logger.warning(f'Bad timestamp in subtitle event: {l}')
+                        continue
+                    if end > start:
+                        events.append([start, end])
+                    used_styles.add(fields['style'].strip().lstrip('*'))
+                    parseAssOverrides(fields['text'], fonts, used_styles)
+    fonts.update(styles[s] for s in used_styles if s in styles)
+    result = {
+        'styles': styles,
+        'used_styles': sorted(used_styles),
+        'fonts': sorted(fonts),
+        'events': mergeRanges(events),
+    }
+    ass_cache[digest] = result
+    return result
+
 def getAssFontsList(filename: str) -> List[str]:
-    with open(filename, 'r', encoding='utf8') as f:
-        lines = f.readlines()
-    fontnames = []
-    for l in lines:
-        l = l.strip()
-        if l.lower().startswith('style:'):
-            # format is normally ignored
-            fontnames.append(l[6:].strip().split(',')[1])
-        elif l.lower().startswith('dialogue:'):
-            fontnames += re.findall(r'{\\fn([^{}\\]+)[^{}]*}', l)
-    return list(set(fontnames))
+    return parseAss(filename)['fonts']
+
+def getFontconfigCacheMtime() -> Optional[float]:
+    mtimes = []
+    for d in fontconfig_cache_dirs:
+        if not os.path.isdir(d):
+            continue
+        mtimes.append(os.path.getmtime(d))
+        mtimes += [os.path.getmtime(os.path.join(d, name)) for name in os.listdir(d)]
+    return max(mtimes) if mtimes else None
+
+def splitFontconfigList(value: str) -> List[str]:
+    # fontconfig escapes ',' inside values with a backslash
+    items = ['']
+    escaped = False
+    for c in value:
+        if escaped:
+            items[-1] += c
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c == ',':
+            items.append('')
+        else:
+            items[-1] += c
+    return [i for i in items if i]
+
+def buildFontIndex() -> Set[str]:
+    listed = subprocess.check_output([info.FC_LIST, '-f', '%{family}\n'], encoding='utf-8')
+    families = set()
+    for l in listed.splitlines():
+        families.update(splitFontconfigList(l))
+    return families
+
+def loadFontIndex(refresh=False) -> Set[str]:
+    '''
+    Installed font families, enumerated by a single fc-list call.
+    The index is kept in memory for the whole batch, and saved into font_cache.json
+    keyed by the fontconfig cache mtime, so it is only rebuilt when fonts change.
+    '''
+    global font_index, font_index_fresh
+    if font_index is not None and not refresh:
+        return font_index
+    cachepath = os.path.join(info.root_directory, 'font_cache.json')
+    mtime = getFontconfigCacheMtime()
+    if not refresh and mtime is not None and os.path.exists(cachepath):
+        with open(cachepath, 'r', encoding='utf-8') as f:
+            cache = json.loads(f.read())
+        if cache.get('mtime') == mtime:
+            font_index = set(cache['families'])
+            font_index_fresh = False
+            return font_index
+    logger.info('Building font index with fc-list...')
+    font_index = buildFontIndex()
+    font_index_fresh = True
+    with open(cachepath, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'mtime': getFontconfigCacheMtime(),
+            'families': sorted(font_index),
+        }))
+    return font_index
 
 def checkFontLinux(fontname: str) -> bool:
-    i = 0
-    while True:
-        matched = subprocess.check_output([
-            info.FC_MATCH,
-            '-f', f'%{{family[{i}]}}', f':family={fontname}'
-        ], encoding='utf-8')
-        if matched == fontname:
-            return True
-        if matched == '':
-            break
-        i += 1
+    if fontname in loadFontIndex():
+        return True
+    if not font_index_fresh:
+        # the saved index may predate a font installed without running fc-cache
+        return fontname in loadFontIndex(refresh=True)
     return False
 
 def checkFontWindows(fontname: str) -> bool:
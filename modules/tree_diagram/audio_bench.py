@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import json
+import wave
+import aifc
+import random
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from queue import Empty
+from typing import List, Optional
+
+from . import info
+from .kit import writeEventName
+from .audio_utils import trimAudio, mergeAndTrimAudio
+
+def generatePCM(filename: str, seconds: float, nchannels: int = 2, sampwidth: int = 2,
+                framerate: int = 48000, format: str = 'aif', seed: int = 0) -> int:
+    '''
+    Write a synthetic PCM file, returns the number of audio frames written.
+    The payload is a pseudo-random block repeated to the requested length.
+    '''
+    if format == 'aif':
+        out = aifc.open(filename, 'wb')
+        comptype = b'NONE'
+    elif format == 'wav':
+        out = wave.open(filename, 'wb')
+        comptype = 'NONE'
+    else:
+        raise ValueError('Unknown fixture format: ' + format)
+    nframes = round(seconds * framerate)
+    block = random.Random(seed).randbytes(framerate * nchannels * sampwidth)
+    out.setparams((nchannels, sampwidth, framerate, nframes, comptype, b'not compressed'))
+    written = 0
+    while written < nframes:
+        n = min(framerate, nframes - written)
+        out.writeframes(block[:n * nchannels * sampwidth])
+        written += n
+    out.close()
+    return nframes
+
+def generateTrimFrames(num_frames: int, count: int, seed: int = 0) -> List[List[int]]:
+    '''
+    Split [0, num_frames) into count ranges, dropping a short gap between
+    each of them, like CMs being removed from a TV capture.
+    '''
+    rnd = random.Random(seed)
+    bounds = sorted(rnd.sample(range(1, num_frames - 1), count * 2 - 1))
+    bounds = [0] + bounds + [num_frames - 1]
+    return [[bounds[i], bounds[i + 1] - 1] for i in range(0, len(bounds) - 1, 2)]
+
+def readProcIO() -> Optional[dict]:
+    if not os.path.exists('/proc/self/io'):
+        return None
+    with open('/proc/self/io', encoding='utf-8') as f:
+        return {k.strip(): int(v) for k, v in (l.split(':') for l in f if ':' in l)}
+
+def readPeakRSS() -> Optional[int]:
+    if info.system == 'Windows':
+        return None
+    # pylint: disable=import-outside-toplevel
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measureCase(name: str, output: str, func, *args) -> dict:
+    io_before = readProcIO()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    io_after = readProcIO()
+    size = os.path.getsize(output)
+    result = {
+        'case': name,
+        'seconds': elapsed,
+        'bytes': size,
+        'mb_per_s': size / elapsed / 1048576 if elapsed > 0 else None,
+        'peak_rss': readPeakRSS(),
+        'syscalls_read': None,
+        'syscalls_write': None,
+    }
+    if io_before is not None and io_after is not None:
+        result['syscalls_read'] = io_after['syscr'] - io_before['syscr']
+        result['syscalls_write'] = io_after['syscw'] - io_before['syscw']
+    return result
+
+def runCase(queue, name: str, output: str, func, *args) -> None:
+    # stdout of the audio utils is noise here, the report is printed by the parent
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+    queue.put(measureCase(name, output, func, *args))
+
+def isolatedCase(name: str, output: str, func, *args) -> dict:
+    # peak RSS is a process-wide high-water mark, so each case gets its own process
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return measureCase(name, output, func, *args)
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=runCase, args=(queue, name, output, func, *args))
+    proc.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Empty:
+            if not proc.is_alive():
+                # crashed or killed before putting its result, check once more for a late put
+                try:
+                    result = queue.get(timeout=1)
+                except Empty:
+                    break
+    proc.join()
+    if result is None:
+        print(f'AudioBench: {name} failed, the process exited with {proc.exitcode}')
+        result = {k: None for k in ['seconds', 'bytes', 'mb_per_s', 'peak_rss', 'syscalls_read', 'syscalls_write']}
+        result.update({'case': f'{name} (failed)', 'error': f'exit code {proc.exitcode}'})
+    return result
+
+def benchAudio(argv: List[str]) -> List[dict]:
+    parser = argparse.ArgumentParser(prog='bench-audio', description='Benchmark audio_filters with synthetic PCM fixtures.')
+    parser.add_argument('--seconds', type=float, default=1440, help='length of each fixture (default: 1440)')
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--sampwidth', type=int, default=2, help='sample width in bytes (default: 2)')
+    parser.add_argument('--framerate', type=int, default=48000)
+    parser.add_argument('--ranges', type=int, default=36, help='number of trim_frames ranges (default: 36)')
+    parser.add_argument('--sources', type=int, default=4, help='number of sources for mergeAndTrimAudio (default: 4)')
+    parser.add_argument('--fps', type=int, nargs=2, default=[24000, 1001], metavar=('NUM', 'DEN'))
+    parser.add_argument('--directory', default=None, help='where fixtures are generated (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='write results as JSON into this file')
+    args = parser.parse_args(argv)
+
+    writeEventName('Audio Benchmark')
+    directory = args.directory or tempfile.mkdtemp(prefix='audio_bench_')
+    os.makedirs(directory, exist_ok=True)
+    fps = args.fps[0] / args.fps[1]
+    saved = {k: info.get(k) for k in ['content', 'temporary']}
+    try:
+        print(f'AudioBench: Generating fixtures in {directory}...')
+        source = os.path.join(directory, 'source.aif')
+        nframes = generatePCM(source, args.seconds, args.channels, args.sampwidth, args.framerate)
+        merged_nframes = sum(
+            generatePCM(os.path.join(directory, f'{i}.aif'), args.seconds / args.sources,
+                        args.channels, args.sampwidth, args.framerate, seed=i)
+            for i in range(args.sources))
+        video_frames = int(min(nframes, merged_nframes) / args.framerate * fps)
+        trim_frames = generateTrimFrames(video_frames, args.ranges)
+
+        info.content = {'source': {'audio_delay': 0}}
+        info.temporary = directory
+        output = os.path.join(directory, 'trimmed.wav')
+        results = [
+            isolatedCase('trimAudio (no trim)', output,
+                         trimAudio, source, source, output, args.fps, None),
+            isolatedCase(f'trimAudio ({len(trim_frames)} ranges)', output,
+                         trimAudio, source, source, output, args.fps, trim_frames),
+            isolatedCase(f'mergeAndTrimAudio ({args.sources} sources)', output,
+                         mergeAndTrimAudio, args.sources, output, args.fps, None),
+            isolatedCase(f'mergeAndTrimAudio ({args.sources} sources, {len(trim_frames)} ranges)', output,
+                         mergeAndTrimAudio, args.sources, output, args.fps, trim_frames),
+        ]
+    finally:
+        for k, v in saved.items():
+            info[k] = v
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    print(f'AudioBench: {args.channels} channel(s), {args.sampwidth * 8} bit, {args.framerate} Hz, {args.seconds} s per fixture')
+    print('{:<56}{:>12}{:>12}{:>12}{:>12}{:>12}'.format('Case', 'Time (s)', 'MB/s', 'Peak RSS', 'Read', 'Write'))
+    print('-' * 116)
+    for r in results:
+        def fmt(v, f='{}'):
+            return '-' if v is None else f.format(v)
+        print('{:<56}{:>12}{:>12}{:>12}{:>12}{:>12}'.format(
+            r['case'], fmt(r['seconds'], '{:.3f}'), fmt(r['mb_per_s'], '{:.1f}'),
+            fmt(r['peak_rss'] and r['peak_rss'] // 1048576, '{} MB'),
+            fmt(r['syscalls_read']), fmt(r['syscalls_write'])))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2))
+    return results
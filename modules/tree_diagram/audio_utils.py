@@ -11,6 +11,11 @@ from .audio_filters import AudioAiffSource, AudioConcat, AudioTrim, AudioOutput,
     wave_params
 
 def getSourceInfo(source: str) -> int:
+    if 'audio_delay' in info.content['source']:
+        print('AudioUtils: Using audio delay in project configure.')
+        delay = info.content['source']['audio_delay']
+        print(f'AudioUtils: Audio delay related to video: {delay} ms')
+        return delay
     xmlstr = subprocess.run([info.MEDIAINFO, '--Output=XML', source], stdout=subprocess.PIPE, check=True).stdout.decode('utf8')
     xml = ET.fromstring(xmlstr)
     vdelay = None
@@ -41,11 +46,7 @@ def getSourceInfo(source: str) -> int:
     if adelay is None:
         print('AudioUtils: No audio delay in stream meta, assume it to 0.')
         adelay = 0
-    if 'audio_delay' in info.content['source']:
-        print('AudioUtils: Using audio delay in project configure.')
-        delay = info.content['source']['audio_delay']
-    else:
-        delay = int((adelay - vdelay) * 1000)
+    delay = int((adelay - vdelay) * 1000)
     print(f'AudioUtils: Audio delay related to video: {delay} ms')
     return delay
 
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
-from typing import List
+from typing import List, Optional
 from datetime import datetime
+from contextlib import contextmanager
 import os
+import time
+import threading
 import unicodedata
 import logging
 
+from ..filters.digest import file_digest # pylint: disable=relative-beyond-top-level
+
 logger = logging.getLogger('tree_diagram')
 
 class ExitException(Exception):
@@ -58,3 +63,115 @@ def padUnicode(s: str, size: int) -> str:
     if l < size:
         return s + ' ' * (size - l)
     return s
+
+source_keys = {}
+
+def sourceKey(filename: str) -> str:
+    '''
+    Content digest of a (possibly multi-GB) source file, for keying caches shared by
+    workers placing the source at different paths. Memoized while the file is unchanged.
+    '''
+    stat = os.stat(filename)
+    memo = (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+    if memo not in source_keys:
+        source_keys[memo] = file_digest(filename)
+    return source_keys[memo]
+
+# accounts of the stages being measured, child processes reaped meanwhile are added to all of them
+stage_accounts = []
+# child processes reaped by background work (index builds) are added here instead,
+# and their CPU time and writes are taken out of the stages they overlapped
+background_usage = {'children_user_time': 0.0, 'children_system_time': 0.0, 'children_peak_rss': None, 'bytes_written': 0}
+background_lock = threading.Lock()
+background_thread = threading.local()
+
+def readUsage() -> Optional[tuple]:
+    if os.name == 'nt':
+        return None
+    # pylint: disable=import-outside-toplevel
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+@contextmanager
+def backgroundWork():
+    '''
+    Child processes reaped in this thread are accounted in background_usage, not in the running stages.
+    '''
+    background_thread.active = True
+    try:
+        yield
+    finally:
+        background_thread.active = False
+
+def recordChildUsage(rusage) -> None:
+    if getattr(background_thread, 'active', False):
+        with background_lock:
+            background_usage['children_user_time'] += rusage.ru_utime
+            background_usage['children_system_time'] += rusage.ru_stime
+            background_usage['children_peak_rss'] = max(background_usage['children_peak_rss'] or 0, rusage.ru_maxrss * 1024)
+            background_usage['bytes_written'] += rusage.ru_oublock * 512
+        return
+    for account in stage_accounts:
+        # ru_maxrss is in KB on Linux
+        account['children_peak_rss'] = max(account['children_peak_rss'] or 0, rusage.ru_maxrss * 1024)
+
+def backgroundAccount(name: str, since: dict) -> dict:
+    '''
+    An account of the background work reaped since the background_usage snapshot since.
+    The peak RSS is the highest since TreeDiagram started.
+    '''
+    with background_lock:
+        usage = dict(background_usage)
+    return {
+        'stage': name,
+        'wall_time': None,
+        'user_time': 0.0,
+        'system_time': 0.0,
+        'children_user_time': usage['children_user_time'] - since['children_user_time'],
+        'children_system_time': usage['children_system_time'] - since['children_system_time'],
+        'children_peak_rss': usage['children_peak_rss'],
+        'bytes_written': usage['bytes_written'] - since['bytes_written'],
+    }
+
+@contextmanager
+def accountStage(name: str, accounts: List[dict]):
+    '''
+    Measure the wall time, the CPU time of TreeDiagram and of child processes,
+    the peak RSS of child processes and the bytes written during a stage.
+    The account is appended to accounts, also when the stage fails.
+    '''
+    account = {
+        'stage': name,
+        'wall_time': None,
+        'user_time': None,
+        'system_time': None,
+        'children_user_time': None,
+        'children_system_time': None,
+        'children_peak_rss': None,
+        'bytes_written': None,
+    }
+    stage_accounts.append(account)
+    with background_lock:
+        background_before = dict(background_usage)
+    before = readUsage()
+    start = time.perf_counter()
+    try:
+        yield account
+    finally:
+        account['wall_time'] = time.perf_counter() - start
+        stage_accounts.remove(account)
+        after = readUsage()
+        if before is not None:
+            (self_before, children_before), (self_after, children_after) = before, after
+            account['user_time'] = self_after.ru_utime - self_before.ru_utime
+            account['system_time'] = self_after.ru_stime - self_before.ru_stime
+            account['children_user_time'] = children_after.ru_utime - children_before.ru_utime
+            account['children_system_time'] = children_after.ru_stime - children_before.ru_stime
+            # block output operations are counted in 512 bytes units
+            account['bytes_written'] = (self_after.ru_oublock - self_before.ru_oublock +
+                                        children_after.ru_oublock - children_before.ru_oublock) * 512
+            # RUSAGE_CHILDREN also has the background work reaped during the stage
+            background = backgroundAccount(name, background_before)
+            for k in ['children_user_time', 'children_system_time', 'bytes_written']:
+                account[k] = max(account[k] - background[k], 0)
+        accounts.append(account)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import json
+import argparse
+from typing import List, Optional
+
+from . import info
+from .kit import writeEventName
+from .process_utils import invokePipeline, pipeMaxSize, y4mFrameSize
+
+# writes a y4m stream of the same frame repeated, as fast as the pipe takes it
+PRODUCER = '''
+import os, sys
+header, frames = sys.argv[1].encode('ascii'), int(sys.argv[2])
+frame = memoryview(b'FRAME\\n' + bytes(int(sys.argv[3])))
+out = os.fdopen(1, 'wb', buffering=0)
+out.write(header)
+for _ in range(frames):
+    written = 0
+    while written < len(frame):
+        written += out.write(frame[written:])
+'''
+
+# reads and drops the stream, pausing every burst frames like an encoder busy with its lookahead
+CONSUMER = '''
+import os, sys, time
+frame_size, burst, stall = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+src = os.fdopen(0, 'rb', buffering=0)
+buf = bytearray(1 << 20)
+total = 0
+while True:
+    n = src.readinto(buf)
+    if not n:
+        break
+    if burst > 0 and (total + n) // (frame_size * burst) > total // (frame_size * burst):
+        time.sleep(stall)
+    total += n
+'''
+
+def readChildSwitches() -> Optional[int]:
+    if info.system == 'Windows':
+        return None
+    # pylint: disable=import-outside-toplevel
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_nvcsw + usage.ru_nivcsw
+
+def measureTransport(name: str, producer: List[str], consumer: List[str], stream_bytes: int, **kwargs) -> dict:
+    switches_before = readChildSwitches()
+    start = time.perf_counter()
+    invokePipeline([producer, True, consumer, True], **kwargs)
+    elapsed = time.perf_counter() - start
+    switches_after = readChildSwitches()
+    return {
+        'case': name,
+        'seconds': elapsed,
+        'bytes': stream_bytes,
+        'mb_per_s': stream_bytes / elapsed / 1048576 if elapsed > 0 else None,
+        'context_switches': switches_after - switches_before if switches_before is not None else None,
+    }
+
+def benchPipe(argv: List[str]) -> List[dict]:
+    parser = argparse.ArgumentParser(prog='bench-pipe', description='Benchmark the transports of invokePipeline with a synthetic y4m stream.')
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--colorspace', default='444p16', help='y4m colorspace (default: 444p16)')
+    parser.add_argument('--burst', type=int, default=0, help='the consumer pauses every this many frames (default: never)')
+    parser.add_argument('--stall', type=float, default=0.05, help='length of each pause in seconds (default: 0.05)')
+    parser.add_argument('--ring-frames', type=int, default=8)
+    parser.add_argument('--output', default=None, help='write results as JSON into this file')
+    args = parser.parse_args(argv)
+
+    writeEventName('Pipe Benchmark')
+    header = f'YUV4MPEG2 W{args.width} H{args.height} F24000:1001 Ip A1:1 C{args.colorspace} XLENGTH={args.frames}\n'
+    frame_size = y4mFrameSize(header.encode('ascii'))
+    if frame_size is None:
+        raise ValueError('Unknown y4m colorspace: ' + args.colorspace)
+    stream_bytes = len(header) + args.frames * (frame_size + len('FRAME\n'))
+    producer = [sys.executable, '-c', PRODUCER, header, str(args.frames), str(frame_size)]
+    consumer = [sys.executable, '-c', CONSUMER, str(frame_size + len('FRAME\n')), str(args.burst), str(args.stall)]
+    cases = [
+        ('direct pipe', {}),
+        ('direct pipe, max size', {'pipe_size': 'max'}),
+        ('copy relay, max size', {'instrument': True, 'interval': 3600, 'pipe_size': 'max'}),
+        ('splice relay, max size', {'transport': 'splice', 'pipe_size': 'max'}),
+        (f'ring relay ({args.ring_frames} frames), max size', {'transport': 'ring', 'ring_frames': args.ring_frames, 'pipe_size': 'max'}),
+    ]
+    print(f'PipeBench: {args.frames} frames of {frame_size / 1048576:.1f} MB, pipe-max-size {pipeMaxSize()}')
+    results = [measureTransport(name, producer, consumer, stream_bytes, **kwargs) for name, kwargs in cases]
+
+    print('{:<44}{:>12}{:>12}{:>18}'.format('Case', 'Time (s)', 'MB/s', 'Context switches'))
+    print('-' * 86)
+    for r in results:
+        def fmt(v, f='{}'):
+            return '-' if v is None else f.format(v)
+        print('{:<44}{:>12}{:>12}{:>18}'.format(
+            r['case'], fmt(r['seconds'], '{:.3f}'), fmt(r['mb_per_s'], '{:.1f}'), fmt(r['context_switches'])))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2))
+    return results
@@ -534,7 +534,7 @@ def precheck() -> None:
             ('mkvpropedit', True),
             ('mp4fpsmod', True),
             ('qaac', True),
-            ('fc-match', True), # fontconfig
+            ('fc-list', True), # fontconfig
             ('x264', False),
             ('x264-7mod', False),
             ('x264-7mod-10bit', False),
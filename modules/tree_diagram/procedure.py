@@ -6,13 +6,17 @@ import shutil
 import logging
 import time
 import json
+import hashlib
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 import yaml
 import requests
 
 from . import info
-from .kit import writeEventName, assertFileWithExit, choices, padUnicode, ExitException
-from .process_utils import invokePipeline
-from .asscheck import checkAssFonts
+from .kit import writeEventName, assertFileWithExit, choices, padUnicode, sourceKey, accountStage, backgroundWork, backgroundAccount, background_usage, background_lock, ExitException
+from .process_utils import invokePipeline, pipelinePlacement
+from .asscheck import checkAssFonts, checkFont, parseAss, fileHash
 from .video_utils import exportTimecodeMP4
 from .audio_utils import extractAudio, trimAudio, encodeAudio, mergeAndTrimAudio
 from .config_loader import ParseContext
@@ -21,9 +25,11 @@ logger = logging.getLogger('tree_diagram')
 
 working_directory = os.path.join(info.root_directory, 'episodes')
 temporary = os.path.join(working_directory, 'temporary')
+cache = os.path.join(working_directory, 'cache')
 
 info.working_directory = working_directory
 info.temporary = temporary
+info.cache = cache
 info.autorun = False
 info.report_endpoint = None
 
@@ -31,6 +37,13 @@ current_working = None
 content = None
 
 missions = None
+loaded_contents = {}
+
+# source filter -> extension of the index it builds
+index_filters = {'LWLibavSource': 'lwi', 'FFmpegSource': 'ffindex', 'FFMS2Source': 'ffindex'}
+index_pool = None
+# index file -> Future of its build
+index_builds = {}
 
 def load_missions():
     global missions
@@ -85,6 +98,11 @@ def loadCurrentWorking(idx: int) -> None:
     if not os.path.exists(current_working):
         logger.critical(f'{current_working} not found')
         raise ExitException(-1)
+    if current_working in loaded_contents:
+        content = loaded_contents[current_working]
+        info.current_working = current_working
+        info.content = content
+        return
 
     with open(current_working, encoding='utf8') as f:
         content = yaml.safe_load(f)
@@ -97,9 +115,26 @@ def loadCurrentWorking(idx: int) -> None:
         logger.critical(f'Unsupported config version: {content["$version"]}')
         raise ExitException(-1)
 
+    loaded_contents[current_working] = content
     info.current_working = current_working
     info.content = content
 
+def subtitleFile(content: dict) -> Optional[str]:
+    if 'subtitle' not in content['source'] or not content['source']['subtitle']:
+        return None
+    if 'filename' not in content['source']['subtitle'] or not content['source']['subtitle']['filename']:
+        return None
+    return os.path.join(working_directory, content['source']['subtitle']['filename'])
+
+def filterIndex(content: dict, name: str) -> Optional[int]:
+    for idx, f in enumerate(content['project']['flow']):
+        if f == name or (isinstance(f, dict) and list(f.keys())[0] == name):
+            return idx
+    return None
+
+def hasFilter(content: dict, name: str) -> bool:
+    return filterIndex(content, name) is not None
+
 def missionReport() -> None:
     writeEventName('Mission Report')
 
@@ -116,6 +151,7 @@ def missionReport() -> None:
     report += [
         {"Output": os.path.join(working_directory, content['output']['filename'])},
     ]
+    report += trialEncode()
 
     yaml.dump(report, sys.stdout, default_flow_style=False)
     message = 'Confirm?'
@@ -168,22 +204,23 @@ def precleanTemporaryFiles() -> None:
         else:
             raise ExitException()
 
+def hasBOM(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\xef\xbb'
+
 def precheckSubtitle() -> None:
-    if 'subtitle' not in content['source'] or not content['source']['subtitle']:
-        return
-    if 'filename' not in content['source']['subtitle'] or not content['source']['subtitle']['filename']:
+    subtitle = subtitleFile(content)
+    if subtitle is None:
         return
     writeEventName('Check SSA fonts')
-    subtitle = os.path.join(working_directory, content['source']['subtitle']['filename'])
-    with open(subtitle, 'rb') as f:
-        if f.read(2) != b'\xef\xbb':
-            message = 'The SSA file has no BOM header, continue?'
-            options = ['&Continue', 'E&xit']
-            answer = 1
-            if not info.autorun:
-                answer = choices(message, options, answer)
-            if answer == 1:
-                raise ExitException()
+    if not hasBOM(subtitle):
+        message = 'The SSA file has no BOM header, continue?'
+        options = ['&Continue', 'E&xit']
+        answer = 1
+        if not info.autorun:
+            answer = choices(message, options, answer)
+        if answer == 1:
+            raise ExitException()
     fonts = checkAssFonts(subtitle)
     all_installed = True
     print('{:16}{:<32}{:<16}'.format('', 'FontFamily', 'IsInstalled'))
@@ -191,6 +228,11 @@ def precheckSubtitle() -> None:
     for f in fonts:
         print('{:16}{}{:<16}'.format('', padUnicode(f['FontFamily'], 32), f['IsInstalled']))
         all_installed = all_installed and f['IsInstalled']
+    ass = parseAss(subtitle)
+    unused_styles = [s for s in ass['styles'] if s not in ass['used_styles']]
+    print(f'Styles in use: {", ".join(ass["used_styles"])}')
+    if unused_styles:
+        print(f'Unused styles (fonts not checked): {", ".join(unused_styles)}')
     message = 'Please make sure that all fonts are installed:'
     options = ['&Confirm', 'E&xit']
     answer = 0 if all_installed else 1
@@ -199,57 +241,530 @@ def precheckSubtitle() -> None:
     if answer == 1:
         raise ExitException()
 
+def cacheTimecode(source: str) -> str:
+    '''
+    Timecodes are exported once per source into the cache directory,
+    then copied into temporary files by each mission using them.
+    '''
+    cached = os.path.join(cache, 'timecodes', f'{sourceKey(source)}.txt')
+    if os.path.exists(cached):
+        return cached
+    if not source.endswith('.mp4'):
+        logger.critical('Exporting timecodes currently only supports MP4 source file.')
+        raise ExitException(-1)
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    exporting = f'{cached}.{os.getpid()}.tmp'
+    exportTimecodeMP4(source=source, exportedTimecode=exporting)
+    os.replace(exporting, cached)
+    return cached
+
 def exportTimecode() -> None:
-    if not any(f == 'VFRToCFR' or (type(f) is dict and list(f.keys())[0] == 'VFRToCFR')
-           for f in content['project']['flow']):
+    if not hasFilter(content, 'VFRToCFR'):
         return
     writeEventName('Export Timecodes')
     source = os.path.join(working_directory, content['source']['filename'])
-    if not source.endswith('.mp4'):
-        logger.critical('Exporting timecodes currently only supports MP4 source file.')
-        raise ExitException(-1)
-    exportTimecodeMP4(source=source, exportedTimecode=os.path.join(temporary, 'timecode.txt'))
+    shutil.copyfile(cacheTimecode(source), os.path.join(temporary, 'timecode.txt'))
+
+def sourceIndexes(content: dict) -> dict:
+    '''
+    Index files of the sources of a mission in the cache directory, keyed by source,
+    {filename in the configure: (source filter, source, index)}.
+    '''
+    for f in content['project']['flow']:
+        name = f if isinstance(f, str) else list(f.keys())[0]
+        if name == 'MultiSource':
+            # arguments are given the same ways as make_tasks passes them to the filter
+            args = None if isinstance(f, str) else f[name]
+            if isinstance(args, dict):
+                source_filter = args.get('source_filter')
+            elif isinstance(args, list):
+                source_filter = args[0] if args else None
+            else:
+                source_filter = args
+            filenames = content['source']['filenames']
+            break
+        if name in index_filters:
+            source_filter = name
+            filenames = [content['source']['filename']]
+            break
+    else:
+        return {}
+    if source_filter not in index_filters:
+        return {}
+    indexes = {}
+    for filename in filenames:
+        source = os.path.join(working_directory, filename)
+        if os.path.exists(source):
+            index = os.path.join(cache, 'indexes', f'{sourceKey(source)}.{index_filters[source_filter]}')
+            indexes[filename] = (source_filter, source, index)
+    return indexes
+
+def buildIndex(source_filter: str, source: str, index: str) -> str:
+    if os.path.exists(index):
+        return index
+    os.makedirs(os.path.dirname(index), exist_ok=True)
+    building = f'{index}.{os.getpid()}.tmp'
+    script = os.path.join(info.root_directory, 'modules', 'index.py')
+    # runs while missions encode, accounted apart from their stages
+    with backgroundWork():
+        invokePipeline([[info.VSPIPE, '--end', '0', '--arg', f'source_filter={source_filter}', '--arg', f'source={source}',
+                         '--arg', f'cachefile={building}', script, '.'], True])
+    assertFileWithExit(building)
+    os.replace(building, index)
+    return index
+
+def prebuildIndexes(contents: list) -> None:
+    '''
+    Build the source indexes of the missions in the background, in the order of the missions,
+    so the first mission only waits for its own sources while the others are being indexed.
+    '''
+    global index_pool
+    if index_pool is None:
+        jobs = (missions or {}).get('index_jobs', min(4, os.cpu_count() or 1))
+        index_pool = ThreadPoolExecutor(max_workers=jobs)
+    for c in contents:
+        for source_filter, source, index in sourceIndexes(c).values():
+            if index not in index_builds and not os.path.exists(index):
+                index_builds[index] = index_pool.submit(buildIndex, source_filter, source, index)
+
+def awaitIndexes() -> None:
+    indexes = sourceIndexes(content)
+    prebuildIndexes([content])
+    builds = [index_builds[index] for _, _, index in indexes.values() if index in index_builds]
+    if not all(build.done() for build in builds):
+        writeEventName('Wait for source indexes')
+    for build in builds:
+        try:
+            build.result()
+        except ExitException:
+            logger.warning('Building a source index failed, the source filter will index the source itself.')
+    info.indexes = {filename: index for filename, (_, _, index) in indexes.items() if os.path.exists(index)}
+
+def precheckMissions() -> None:
+    '''
+    Check all missions at once: subtitles and timecodes are deduplicated and
+    processed concurrently, then a single report is shown.
+    '''
+    if not missions['missions']:
+        return
+    contents = []
+    for idx in range(len(missions['missions'])):
+        loadCurrentWorking(idx)
+        contents.append(content)
+    loadCurrentWorking(0)
+    precleanTemporaryFiles()
+    # the index builder loads the plugins listed in TDINFO
+    exportEnvironment()
+    prebuildIndexes(contents)
+
+    writeEventName('Check missions')
+    subtitles = sorted({os.path.realpath(s) for s in map(subtitleFile, contents) if s is not None})
+    timecode_sources = sorted({os.path.realpath(os.path.join(working_directory, c['source']['filename']))
+                               for c in contents if hasFilter(c, 'VFRToCFR')})
+    with ThreadPoolExecutor() as pool:
+        timecode_futures = [pool.submit(cacheTimecode, source) for source in timecode_sources]
+        hashes = dict(zip(subtitles, pool.map(fileHash, subtitles)))
+        unique = {h: s for s, h in hashes.items()}
+        parsed = dict(zip(unique, pool.map(parseAss, unique.values())))
+        boms = dict(zip(unique, pool.map(hasBOM, unique.values())))
+        for f in timecode_futures:
+            f.result()
+    print(f'{len(subtitles)} subtitle(s), {len(unique)} unique; {len(timecode_sources)} timecode(s) exported.')
+
+    fonts = {f: checkFont(f) for h in parsed for f in parsed[h]['fonts']}
+    problems = False
+    print('{:16}{}{:<12}{:<12}{:<16}'.format('', padUnicode('Title', 72), 'Output', 'BOM', 'Missing Fonts'))
+    print('{:16}{}'.format('', '-' * 112))
+    for c in contents:
+        output_exists = os.path.exists(os.path.join(working_directory, c['output']['filename']))
+        subtitle = subtitleFile(c)
+        bom = '-'
+        missing = '-'
+        if subtitle is not None:
+            h = hashes[os.path.realpath(subtitle)]
+            bom = 'OK' if boms[h] else 'MISSING'
+            missing = sum(1 for f in parsed[h]['fonts'] if not fonts[f])
+            problems = problems or not boms[h] or missing > 0
+        problems = problems or output_exists
+        print('{:16}{}{:<12}{:<12}{:<16}'.format('', padUnicode(c['title'], 72),
+              'EXISTS' if output_exists else 'OK', bom, missing))
+    if not all(fonts.values()):
+        print('{:16}{:<32}'.format('', 'Missing FontFamily'))
+        print('{:16}{}'.format('', '-' * 48))
+        for f in sorted(f for f in fonts if not fonts[f]):
+            print('{:16}{}'.format('', f))
+
+    if problems:
+        message = 'Existing outputs will be OVERWRITTEN, please also make sure that all subtitles have BOM headers and all fonts are installed:'
+        options = ['&Confirm', 'E&xit']
+        answer = 1
+        if not info.autorun:
+            answer = choices(message, options, answer)
+        if answer == 1:
+            raise ExitException()
 
-def processVideo() -> None:
-    output = os.path.join(temporary, 'video-encoded.mp4')
-    writeEventName('Process video & Encode')
-    if '+special' in content and 'skip_process_video' in content['+special']:
-        print('Skipping processVideo due to project configure.')
-        print('NOTE: This is a special behavior, you may want to delete "+special" segment in your project configure.')
+def exportSubtitleEvents() -> None:
+    subtitle = subtitleFile(content)
+    if subtitle is None or not subtitle.lower().endswith(('.ass', '.ssa')):
         return
+    events = parseAss(subtitle)['events']
+    print(f'Subtitle events: {len(events)} range(s) to be rendered.')
+    with open(os.path.join(temporary, 'subtitle_events.json'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'filename': os.path.realpath(subtitle),
+            'events': events,
+        }))
+
+def exportEnvironment() -> None:
     tdinfo = dict(info)
     tdinfo['binaries'] = None # avoid envvar growing too large
     os.environ['TDINFO'] = json.dumps(tdinfo)
     os.environ['DISPLAY'] = '' # workaround to avoid usage of X
-    vapoursynth_pipeline = [
-        '-c',
-        'y4m',
-        os.path.join(info.root_directory, 'modules', 'misaka64.py'),
-        '-',
-    ]
+
+def exportSceneChanges() -> Optional[str]:
+    '''
+    The scene change index is computed once per source and flow prefix (up to
+    the SceneChange step) into the cache directory, then copied into temporary
+    files for the SceneChange filter. Returns the path of a qpfile of the scene
+    changes, or None if the frames after SceneChange do not match the output.
+    '''
+    position = filterIndex(content, 'SceneChange')
+    if position is None:
+        return None
+    writeEventName('Scene Change Index')
+    flow = content['project']['flow']
+    source = os.path.join(working_directory, content['source']['filename'])
+    key = hashlib.sha1((sourceKey(source) + json.dumps(flow[:position + 1], sort_keys=True)).encode('utf-8')).hexdigest()
+    cached = os.path.join(cache, 'scenechanges', f'{key}.json')
+    script = os.path.join(info.root_directory, 'modules', 'scenechange.py')
+    clipinfo = os.path.join(temporary, 'scenechange_clipinfo.json')
+    if os.path.exists(cached):
+        # only the frame counts are needed, render a single frame
+        invokePipeline([[info.VSPIPE, '--end', '0', script, '.'], True])
+    else:
+        flags = os.path.join(temporary, 'scenechange.raw')
+        invokePipeline([[info.VSPIPE, script, flags], True])
+        assertFileWithExit(flags)
+        with open(flags, 'rb') as f:
+            scenes = [n for n, b in enumerate(f.read()) if b]
+        with open(clipinfo, encoding='utf-8') as f:
+            frames = json.load(f)['frames']
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        exporting = f'{cached}.{os.getpid()}.tmp'
+        with open(exporting, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'frames': frames, 'scenes': scenes}))
+        os.replace(exporting, cached)
+    shutil.copyfile(cached, os.path.join(temporary, 'scenechange.json'))
+    with open(cached, encoding='utf-8') as f:
+        index = json.load(f)
+    with open(clipinfo, encoding='utf-8') as f:
+        output_frames = json.load(f)['output_frames']
+    print(f'Scene change: {len(index["scenes"])} scene change(s) in {index["frames"]} frames.')
+    if output_frames != index['frames']:
+        print('Scene change: The flow changes the frame count after SceneChange, no qpfile is written.')
+        return None
+    qpfile = os.path.join(temporary, 'qpfile.txt')
+    with open(qpfile, 'w', encoding='utf-8') as f:
+        f.writelines(f'{n} K\n' for n in index['scenes'] if n > 0)
+    return qpfile
+
+def prepareVideo() -> Optional[str]:
+    '''
+    Export what the flow reads from temporary files, returns the qpfile of the scene changes.
+    '''
+    exportTimecode()
+    exportSubtitleEvents()
+    awaitIndexes()
+    exportEnvironment()
+    return exportSceneChanges()
+
+def encoderCommand(encoder_params: list, output: str, ivf_output: str) -> list:
+    '''
+    The encoder reading y4m from stdin, x264/x265 write output, the AV1 encoders ivf_output.
+    '''
     encoder = content['project']['encoder']
     if encoder.upper() not in info:
         logger.critical(f'Encoder {encoder} is not supported. See Environment Check output for supported encoder executables.')
         raise ExitException(-1)
-    encoder_binary = info[encoder.upper()]
-    encoder_params = content['project']['encoder_params'].split()
     if encoder.lower().startswith('x264'):
         encoder_params = ['-', '--demuxer', 'y4m'] + encoder_params + ['--output', output]
     elif encoder.lower().startswith('x265'):
         encoder_params = ['--y4m'] + encoder_params + ['--output', output, '-']
     elif encoder.lower().startswith('rav1e'):
-        encoder_params = ['-'] + encoder_params + ['--output', os.path.join(temporary, 'video-encoded.ivf')]
+        encoder_params = ['-'] + encoder_params + ['--output', ivf_output]
     elif encoder.lower().startswith('svtav1'):
-        encoder_params = ['-i', 'stdin'] + encoder_params + ['-b', os.path.join(temporary, 'video-encoded.ivf')]
+        encoder_params = ['-i', 'stdin'] + encoder_params + ['-b', ivf_output]
     else:
         logger.critical(f"Encoder {encoder} is not supported.")
         raise ExitException(-1)
-    invokePipeline([
-        [info.VSPIPE] + vapoursynth_pipeline, True,
-        [encoder_binary] + encoder_params
-    ])
+    return [info[encoder.upper()]] + encoder_params
+
+def processVideo() -> None:
+    output = os.path.join(temporary, 'video-encoded.mp4')
+    writeEventName('Process video & Encode')
+    if '+special' in content and 'skip_process_video' in content['+special']:
+        print('Skipping processVideo due to project configure.')
+        print('NOTE: This is a special behavior, you may want to delete "+special" segment in your project configure.')
+        return
+    qpfile = prepareVideo()
+    if content['project']['performance'].get('renderer', 'vspipe') == 'python':
+        # in-process renderer, the interpreter running TreeDiagram must be able to import vapoursynth
+        render_pipeline = [sys.executable, os.path.join(info.root_directory, 'modules', 'render.py')]
+    else:
+        render_pipeline = [info.VSPIPE, '-c', 'y4m', os.path.join(info.root_directory, 'modules', 'misaka64.py'), '-']
+    encoder = content['project']['encoder']
+    performance = content['project']['performance']
+    with pipelinePlacement(performance.get('placement'), 2) as affinity:
+        encoder_params = content['project']['encoder_params'].split()
+        if affinity is not None:
+            # size the encoder thread pool to the CPUs it is pinned to
+            for prefix, threads_option in [('x264', '--threads'), ('x265', '--pools'), ('rav1e', '--threads'), ('svtav1', '--lp')]:
+                if encoder.lower().startswith(prefix) and threads_option not in encoder_params:
+                    encoder_params += [threads_option, str(len(affinity[1]))]
+        if qpfile is not None and encoder.lower().startswith(('x264', 'x265')):
+            encoder_params += ['--qpfile', qpfile]
+        invokePipeline([
+            render_pipeline, True,
+            encoderCommand(encoder_params, output, os.path.join(temporary, 'video-encoded.ivf'))
+        ], instrument=performance.get('telemetry', False), affinity=affinity,
+           transport=performance.get('pipe_transport', 'pipe'), pipe_size=performance.get('pipe_size'),
+           ring_frames=performance.get('pipe_ring_frames', 8))
     assertFileWithExit(output)
 
+def trialSegments(frames: int, count: int, length: int) -> List[List[int]]:
+    '''
+    count segments of length frames spread evenly over the output, [first, last] inclusive.
+    They start on the nearest scene change when the scene change index matches the output.
+    '''
+    scenes = []
+    index_path = os.path.join(temporary, 'scenechange.json')
+    if os.path.exists(index_path):
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+        if index['frames'] == frames:
+            scenes = index['scenes']
+    if frames <= 0:
+        return []
+    count = max(min(count, frames), 1)
+    length = max(min(length, frames // count), 1)
+    segments = []
+    for i in range(count):
+        # centered in the i-th of count equal slices of the output
+        first = frames * i // count + (frames // count - length) // 2
+        candidates = [n for n in scenes if n + length <= frames and (not segments or n > segments[-1][1])]
+        if candidates:
+            first = min(candidates, key=lambda n, first=first: abs(n - first))
+        if segments and first <= segments[-1][1]:
+            continue
+        segments.append([first, first + length - 1])
+    return segments
+
+# encoder options naming a file shared by the whole encode (multi-pass stats, keyframes), with their value
+trial_stripped_options = ['--pass', '--stats', '--qpfile', '--first-pass', '--second-pass']
+
+def trialParams(encoder_params: list) -> list:
+    '''
+    encoder_params for the trial segments, single pass and without the options above,
+    so concurrent segments do not share a stats file.
+    '''
+    params = []
+    stripped = []
+    skip = False
+    for p in encoder_params:
+        if skip:
+            skip = False
+        elif p.split('=')[0] in trial_stripped_options:
+            stripped.append(p.split('=')[0])
+            skip = '=' not in p
+        else:
+            params.append(p)
+    if stripped:
+        logger.warning(f'Trial: {", ".join(stripped)} removed from encoder_params, segments are encoded in a single pass.')
+    return params
+
+def runTrial(segments: List[List[int]], encoder_params: list, jobs: int, directory: str) -> dict:
+    '''
+    Render and encode segments, jobs at a time, returns the frames, bytes and wall time of all of them,
+    and the number of rounds of jobs segments that ran.
+    '''
+    script = os.path.join(info.root_directory, 'modules', 'misaka64.py')
+    def encode(idx: int, first: int, last: int) -> int:
+        output = os.path.join(directory, f'segment{idx}.mp4')
+        ivf_output = os.path.join(directory, f'segment{idx}.ivf')
+        clipinfo = os.path.join(directory, f'segment{idx}.json')
+        for f in [output, ivf_output]:
+            if os.path.exists(f):
+                os.remove(f)
+        invokePipeline([
+            [info.VSPIPE, '-c', 'y4m', '--start', str(first), '--end', str(last), '--arg', f'clipinfo={clipinfo}', script, '-'], True,
+            encoderCommand(encoder_params, output, ivf_output), True
+        ])
+        return os.path.getsize(output if os.path.exists(output) else ivf_output)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        sizes = list(pool.map(lambda seg: encode(seg[0], *seg[1]), enumerate(segments)))
+    return {
+        'frames': sum(last - first + 1 for first, last in segments),
+        'bytes': sum(sizes),
+        'seconds': time.perf_counter() - start,
+        'rounds': math.ceil(len(segments) / jobs),
+    }
+
+def predictEncode(trial: dict, frames: int, fps: float, startup: float) -> dict:
+    # the segments run concurrently, so the time is extrapolated from the throughput of the whole trial,
+    # without the startup (loading the flow, opening the source) that every round of segments paid
+    # but the whole encode pays once. This assumes the full encode, a single pipeline, gets the same
+    # throughput as jobs concurrent segments, and a single pass.
+    encoding = max(trial['seconds'] - startup * trial['rounds'], 0.0)
+    bitrate = trial['bytes'] * 8 / (trial['frames'] / fps)
+    return {
+        'bitrate': bitrate,
+        'size': bitrate * frames / fps / 8,
+        'seconds': startup + encoding * frames / trial['frames'],
+    }
+
+def searchCRF(segments: List[List[int]], encoder_params: list, jobs: int, directory: str,
+              frames: int, fps: float, startup: float, target: float, steps: int) -> Optional[tuple]:
+    '''
+    Trial encodes with the --crf of encoder_params moved towards the target size,
+    returns the (crf, prediction) closest to the target.
+    '''
+    if '--crf' not in encoder_params:
+        logger.warning('Trial: encoder_params has no --crf, skipping the CRF search.')
+        return None
+    params = list(encoder_params)
+    pos = params.index('--crf') + 1
+    crf = float(params[pos])
+    points = []
+    for _ in range(steps):
+        params[pos] = f'{crf:g}'
+        prediction = predictEncode(runTrial(segments, params, jobs, directory), frames, fps, startup)
+        points.append((crf, prediction))
+        print(f'Trial: CRF {crf:g}: {prediction["size"] / 1048576:.0f} MB predicted, target {target / 1048576:.0f} MB')
+        if abs(prediction['size'] - target) / target < 0.03:
+            break
+        if len(points) == 1:
+            # the size roughly halves every 6 CRF steps
+            crf += 6 * math.log2(prediction['size'] / target)
+        else:
+            (crf0, p0), (crf1, p1) = points[-2], points[-1]
+            slope = (math.log(p1['size']) - math.log(p0['size'])) / (crf1 - crf0) if crf1 != crf0 else 0
+            if slope >= 0:
+                break
+            crf = crf1 + (math.log(target) - math.log(p1['size'])) / slope
+        crf = round(min(max(crf, 0), 51), 1)
+        if any(c == crf for c, _ in points):
+            break
+    return min(points, key=lambda p: abs(math.log(p[1]['size'] / target)))
+
+def trialEncode() -> list:
+    '''
+    Predict the bitrate, size and encode time of the video from trial encodes of a few
+    segments, configured by project.trial:
+        segments: 6        # number of segments
+        frames: 48         # length of each segment
+        jobs: 2            # segments encoded at once
+        target_size: 4096  # MB, search the --crf of encoder_params for this size
+        crf_steps: 3       # trial encodes in the search
+    Returns entries for the mission report.
+    '''
+    trial = content['project'].get('trial')
+    if not trial or ('+special' in content and 'skip_process_video' in content['+special']):
+        return []
+    if not isinstance(trial, dict):
+        trial = {}
+    writeEventName('Trial Encode')
+    prepareVideo()
+    # a single frame is enough for the flow to write the output clip info
+    probe = [[info.VSPIPE, '--end', '0', os.path.join(info.root_directory, 'modules', 'misaka64.py'), '.'], True]
+    invokePipeline(probe)
+    with open(os.path.join(temporary, 'clipinfo.json'), encoding='utf-8') as f:
+        clipinfo = json.load(f)
+    frames = clipinfo['frames']
+    fps = clipinfo['fps'][0] / clipinfo['fps'][1]
+    segments = trialSegments(frames, trial.get('segments', 6), trial.get('frames', 48))
+    if not segments:
+        logger.warning(f'Trial: The output has {frames} frames, skipping the trial encode.')
+        return []
+    # the first probe may have built indexes, time a second one for the startup of every segment
+    startup = time.perf_counter()
+    invokePipeline(probe)
+    startup = time.perf_counter() - startup
+    jobs = trial.get('jobs', 2)
+    directory = os.path.join(temporary, 'trial')
+    os.makedirs(directory, exist_ok=True)
+    encoder_params = trialParams(content['project']['encoder_params'].split())
+    try:
+        print(f'Trial: {len(segments)} segment(s) of {segments[0][1] - segments[0][0] + 1} frames, {jobs} at a time')
+        prediction = predictEncode(runTrial(segments, encoder_params, jobs, directory), frames, fps, startup)
+        report = [
+            {'Predicted Bitrate': f'{prediction["bitrate"] / 1000:.0f} kbps'},
+            {'Predicted Video Size': f'{prediction["size"] / 1048576:.0f} MB'},
+            {'Predicted Encode Time': time.strftime('%H:%M:%S', time.gmtime(prediction['seconds']))},
+        ]
+        if trial.get('target_size'):
+            best = searchCRF(segments, encoder_params, jobs, directory, frames, fps, startup,
+                             trial['target_size'] * 1048576, trial.get('crf_steps', 3))
+            if best is not None:
+                report.append({'Suggested CRF': f'{best[0]:g} ({best[1]["size"] / 1048576:.0f} MB predicted)'})
+    finally:
+        shutil.rmtree(directory)
+    return report
+
+def qualityCheck() -> None:
+    '''
+    PSNR and SSIM of sampled frames of the encoded video, configured by project.qc:
+        frames: 200         # frames sampled
+        reference: source   # source (up to TrimFrames) or output (the whole flow)
+        min_psnr: 30        # fail the mission if a luma PSNR is lower
+        min_ssim: 0.9       # fail the mission if the mean luma SSIM is lower
+    The samples and a summary are written next to the output as <output>.qc.json.
+    '''
+    qc = content['project'].get('qc')
+    if not qc or ('+special' in content and 'skip_process_video' in content['+special']):
+        return
+    if not isinstance(qc, dict):
+        qc = {}
+    writeEventName('Quality Check')
+    encoded = os.path.join(temporary, 'video-encoded.mp4')
+    if not os.path.exists(encoded):
+        encoded = os.path.join(temporary, 'video-encoded.ivf')
+    script = os.path.join(info.root_directory, 'modules', 'qc.py')
+    invokePipeline([[info.VSPIPE, '--arg', f'encoded={encoded}', script, '.'], True])
+    results = os.path.join(temporary, 'qc.jsonl')
+    assertFileWithExit(results)
+    with open(results, encoding='utf-8') as f:
+        samples = sorted((json.loads(l) for l in f if l.strip()), key=lambda r: r.get('frame', 0))
+    if samples and 'error' in samples[0]:
+        logger.warning(f'QC: Skipped, {samples[0]["error"]}.')
+        return
+    summary = []
+    for plane in range(len(samples[0]['planes']) if samples else 0):
+        psnr = [r['planes'][plane]['psnr'] for r in samples]
+        ssim = [r['planes'][plane]['ssim'] for r in samples]
+        summary.append({
+            'plane': plane,
+            'psnr_mean': sum(psnr) / len(psnr), 'psnr_min': min(psnr),
+            'ssim_mean': sum(ssim) / len(ssim), 'ssim_min': min(ssim),
+            'worst_frame': samples[psnr.index(min(psnr))]['frame'],
+        })
+    output = os.path.join(working_directory, content['output']['filename'])
+    with open(f'{output}.qc.json', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'title': content['title'], 'reference': qc.get('reference', 'source'),
+                            'summary': summary, 'samples': samples}, indent=2))
+    print(f'QC: {len(samples)} frames sampled.')
+    print('{:<8}{:>12}{:>12}{:>12}{:>12}{:>14}'.format('Plane', 'PSNR mean', 'PSNR min', 'SSIM mean', 'SSIM min', 'Worst frame'))
+    print('-' * 70)
+    for s in summary:
+        print('{:<8}{:>12.2f}{:>12.2f}{:>12.4f}{:>12.4f}{:>14}'.format(
+            s['plane'], s['psnr_mean'], s['psnr_min'], s['ssim_mean'], s['ssim_min'], s['worst_frame']))
+    if summary and 'min_psnr' in qc and summary[0]['psnr_min'] < qc['min_psnr']:
+        logger.critical(f'QC: Luma PSNR {summary[0]["psnr_min"]:.2f} of frame {summary[0]["worst_frame"]} is below {qc["min_psnr"]}.')
+        raise ExitException(-1)
+    if summary and 'min_ssim' in qc and summary[0]['ssim_mean'] < qc['min_ssim']:
+        logger.critical(f'QC: Mean luma SSIM {summary[0]["ssim_mean"]:.4f} is below {qc["min_ssim"]}.')
+        raise ExitException(-1)
+
 def processAudio() -> None:
     writeEventName('Process audio & Encode')
     if '+special' in content and 'skip_process_audio' in content['+special']:
@@ -336,12 +851,28 @@ def cleanTemporaryFiles(force=False) -> None:
         shutil.rmtree(temporary)
         os.makedirs(temporary)
 
-def missionComplete():
+def missionComplete(accounts: Optional[list] = None):
     output = os.path.join(working_directory, content['output']['filename'])
     writeEventName('Mission Complete')
     invokePipeline([[info.MEDIAINFO, output]])
+    summary = ''
+    if accounts:
+        with open(f'{output}.stages.json', 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'title': content['title'], 'output': output, 'node': info.node, 'stages': accounts}, indent=2))
+        def fmt(v, f):
+            return '-' if v is None else f.format(v)
+        print('{:<16}{:>12}{:>12}{:>12}{:>16}{:>16}'.format('Stage', 'Wall (s)', 'User (s)', 'System (s)', 'Peak RSS', 'Written'))
+        print('-' * 84)
+        for a in accounts:
+            user = None if a['user_time'] is None else a['user_time'] + a['children_user_time']
+            system = None if a['system_time'] is None else a['system_time'] + a['children_system_time']
+            print('{:<16}{:>12}{:>12}{:>12}{:>16}{:>16}'.format(
+                a['stage'], fmt(a['wall_time'], '{:.1f}'), fmt(user, '{:.1f}'), fmt(system, '{:.1f}'),
+                fmt(a['children_peak_rss'] and a['children_peak_rss'] // 1048576, '{} MB'),
+                fmt(a['bytes_written'] and a['bytes_written'] // 1048576, '{} MB')))
+        summary = ' (' + ', '.join(f'{a["stage"]} {a["wall_time"]:.0f}s' for a in accounts if a['wall_time'] is not None) + ')'
     if info.report_endpoint is not None:
-        report = f'[{info.node}] Mission Complete: {content["title"]}'
+        report = f'[{info.node}] Mission Complete: {content["title"]}{summary}'
         requests.post(info.report_endpoint, report.encode('utf-8'), timeout=30)
 
 def syncContent():
@@ -351,30 +882,33 @@ def syncContent():
 
 def runMission():
     missionReport()
+    accounts = []
+    with background_lock:
+        background_before = dict(background_usage)
     try:
-        processVideo()
-        processAudio()
-        mkvMerge()
-        mkvMetainfo()
+        for stage in [processVideo, qualityCheck, processAudio, mkvMerge, mkvMetainfo]:
+            with accountStage(stage.__name__, accounts):
+                stage()
+        # index builds of later missions that finished meanwhile
+        accounts.append(backgroundAccount('Index', background_before))
         cleanTemporaryFiles(force=True)
     except Exception as e:
         if info.report_endpoint is not None:
             report = f'[{info.node}] Mission Failed With Exception: {e}'
             requests.post(info.report_endpoint, report.encode('utf-8'), timeout=30)
         raise
-    missionComplete()
+    missionComplete(accounts)
 
 def main() -> None:
     load_missions()
-    for idx in range(len(missions['missions'])):
-        loadCurrentWorking(idx)
-        precleanTemporaryFiles()
-        precheckOutput()
-        precheckSubtitle()
-        exportTimecode()
-    for idx in range(len(missions['missions'])):
-        loadCurrentWorking(idx)
-        runMission()
+    try:
+        precheckMissions()
+        for idx in range(len(missions['missions'])):
+            loadCurrentWorking(idx)
+            runMission()
+    finally:
+        if index_pool is not None:
+            index_pool.shutdown(cancel_futures=True)
 
 def genVseditFile() -> None:
     writeEventName('Generate VSEdit Script')
@@ -392,7 +926,11 @@ os.environ['PATH'] = {repr(os.environ['PATH'])}
 ''')
         if sys.platform == 'linux':
             f.write(f'''os.environ['LD_LIBRARY_PATH'] = {repr(os.environ['LD_LIBRARY_PATH'])}\n''')
-        f.write('''from misaka64 import main\n''')
+        if content['project'].get('preview'):
+            # proxy preview with a frame cache, see modules/preview.py
+            f.write('''from preview import main\n''')
+        else:
+            f.write('''from misaka64 import main\n''')
         f.write('''main()\n''')
     assertFileWithExit(outputScript)
     print(f'Generated script file: {outputScript}')
@@ -1,17 +1,468 @@
 #!/usr/bin/env python3
 
-from typing import List
+from typing import List, Optional, Callable
+from contextlib import contextmanager
+import os
+import time
+import select
+import tempfile
+import threading
 import subprocess
 from subprocess import Popen
 import logging
 from . import info
-from .kit import ExitException
+from .kit import ExitException, recordChildUsage
+from ..filters.numa import parse_cpulist, numa_nodes # pylint: disable=relative-beyond-top-level
 
 logger = logging.getLogger('tree_diagram')
 
-def invokePipeline(pipeline: List[List[str]]) -> None:
+# callables receiving the progress events of instrumented pipelines (performance.telemetry)
+progress_listeners: List[Callable[[dict], None]] = []
+
+# y4m colorspace -> (bytes per sample, samples per pixel)
+y4m_colorspaces = {
+    'mono': (1, 1), 'mono16': (2, 1),
+    '420jpeg': (1, 1.5), '420paldv': (1, 1.5), '420mpeg2': (1, 1.5), '420': (1, 1.5),
+    '422': (1, 2), '444': (1, 3), '444alpha': (1, 4),
+}
+
+def y4mFrameSize(header: bytes) -> Optional[int]:
+    params = {p[:1]: p[1:] for p in header.decode('ascii', 'replace').split()[1:]}
+    width, height = int(params.get('W', 0)), int(params.get('H', 0))
+    colorspace = params.get('C', '420jpeg')
+    if colorspace in y4m_colorspaces:
+        sample, ratio = y4m_colorspaces[colorspace]
+    else:
+        # e.g. 420p10, 444p16, mono12
+        layout, _, depth = colorspace.partition('p') if not colorspace.startswith('mono') else ('mono', '', colorspace[4:])
+        if layout not in y4m_colorspaces or not depth.isdigit():
+            return None
+        sample, ratio = 1 if int(depth) <= 8 else 2, y4m_colorspaces[layout][1]
+    return int(width * height * ratio) * sample
+
+class Y4MCounter:
+    '''
+    Count frames of a y4m stream passing through, chunk by chunk.
+    '''
+    def __init__(self):
+        self.frames = 0
+        self.total = None
+        self.frame_size = None
+        self.line = b''
+        self.remaining = 0
+        self.valid = None
+
+    def feed(self, data: memoryview) -> None:
+        pos = 0
+        while pos < len(data) and self.valid is not False:
+            if self.remaining > 0:
+                n = min(self.remaining, len(data) - pos)
+                self.remaining -= n
+                pos += n
+                if self.remaining == 0:
+                    self.frames += 1
+                continue
+            end = bytes(data[pos:pos + 256]).find(b'\n')
+            if end == -1:
+                self.line += bytes(data[pos:pos + 256])
+                pos += min(256, len(data) - pos)
+                if len(self.line) > 4096:
+                    self.valid = False
+                continue
+            line = self.line + bytes(data[pos:pos + end])
+            self.line = b''
+            pos += end + 1
+            if self.valid is None:
+                self.valid = line.startswith(b'YUV4MPEG2')
+                if self.valid:
+                    self.frame_size = y4mFrameSize(line)
+                    self.valid = self.frame_size is not None
+                    for p in line.split():
+                        if p.startswith(b'XLENGTH='):
+                            self.total = int(p[8:])
+            elif line.startswith(b'FRAME'):
+                self.remaining = self.frame_size
+            else:
+                self.valid = False
+
+class PipeRelay:
+    '''
+    Copy the output of a process into the input of the next one, counting what passes.
+    Time blocked on reading means the upstream process is slower, on writing the downstream one.
+    '''
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.bytes = 0
+        self.read_wait = 0.0
+        self.write_wait = 0.0
+        self.y4m = Y4MCounter()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        buf = bytearray(1 << 20)
+        view = memoryview(buf)
+        try:
+            while True:
+                start = time.perf_counter()
+                n = self.src.readinto(buf)
+                self.read_wait += time.perf_counter() - start
+                if not n:
+                    break
+                self.y4m.feed(view[:n])
+                start = time.perf_counter()
+                written = 0
+                while written < n:
+                    written += self.dst.write(view[written:n])
+                self.write_wait += time.perf_counter() - start
+                self.bytes += n
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            for f in [self.src, self.dst]:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+
+class SpliceRelay(PipeRelay):
+    '''
+    PipeRelay moving the data with os.splice, without copying it through TreeDiagram.
+    Only the y4m header is read, frames are counted from the byte count,
+    which holds for streams without frame parameters, like vspipe writes.
+    '''
+    def run(self) -> None:
+        if not hasattr(os, 'splice'):
+            PipeRelay.run(self)
+            return
+        src, dst = self.src.fileno(), self.dst.fileno()
+        try:
+            header = self.src.readline(4096)
+            self.y4m.feed(memoryview(header))
+            self.dst.write(header)
+            self.bytes += len(header)
+            frame = self.y4m.frame_size + len(b'FRAME\n') if self.y4m.valid else None
+            while True:
+                try:
+                    n = os.splice(src, dst, 1 << 24, flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    start = time.perf_counter()
+                    if not select.select([src], [], [], 0)[0]:
+                        select.select([src], [], [])
+                        self.read_wait += time.perf_counter() - start
+                    else:
+                        select.select([], [dst], [])
+                        self.write_wait += time.perf_counter() - start
+                    continue
+                if not n:
+                    break
+                self.bytes += n
+                if frame is not None:
+                    self.y4m.frames = (self.bytes - len(header)) // frame
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            for f in [self.src, self.dst]:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+
+class RingRelay(PipeRelay):
+    '''
+    PipeRelay through a ring buffer of a few y4m frames, so a burst of reads of the
+    downstream process (e.g. an encoder filling its lookahead) does not stall the upstream one.
+    '''
+    def __init__(self, src, dst, frames):
+        self.frames = frames
+        self.cond = threading.Condition()
+        self.head = 0 # bytes read into the ring
+        self.tail = 0 # bytes written out of the ring
+        self.eof = False
+        self.broken = False
+        super().__init__(src, dst)
+
+    def run(self) -> None:
+        writer = None
+        try:
+            header = self.src.readline(4096)
+            self.y4m.feed(memoryview(header))
+            frame = self.y4m.frame_size + len(b'FRAME\n') if self.y4m.valid else 1 << 20
+            self.ring = memoryview(bytearray(max(self.frames, 1) * frame))
+            self.ring[:len(header)] = header
+            self.head = len(header)
+            writer = threading.Thread(target=self.drain, daemon=True)
+            writer.start()
+            size = len(self.ring)
+            while True:
+                with self.cond:
+                    while self.head - self.tail == size and not self.broken:
+                        self.cond.wait()
+                    if self.broken:
+                        break
+                    start = self.head % size
+                    n = min(size - start, size - (self.head - self.tail))
+                wait_start = time.perf_counter()
+                n = self.src.readinto(self.ring[start:start + n])
+                self.read_wait += time.perf_counter() - wait_start
+                if not n:
+                    break
+                self.y4m.feed(self.ring[start:start + n])
+                with self.cond:
+                    self.head += n
+                    self.cond.notify_all()
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            with self.cond:
+                self.eof = True
+                self.cond.notify_all()
+            if writer is not None:
+                writer.join()
+            for f in [self.src, self.dst]:
+                try:
+                    f.close()
+                except OSError:
+                    pass
+
+    def drain(self) -> None:
+        size = len(self.ring)
+        try:
+            while True:
+                with self.cond:
+                    while self.head == self.tail and not self.eof:
+                        self.cond.wait()
+                    if self.head == self.tail:
+                        break
+                    start = self.tail % size
+                    n = min(size - start, self.head - self.tail)
+                wait_start = time.perf_counter()
+                written = self.dst.write(self.ring[start:start + n])
+                self.write_wait += time.perf_counter() - wait_start
+                with self.cond:
+                    self.tail += written
+                    self.bytes += written
+                    self.cond.notify_all()
+        except (BrokenPipeError, OSError, ValueError):
+            with self.cond:
+                self.broken = True
+                self.cond.notify_all()
+
+def pipeMaxSize() -> Optional[int]:
+    try:
+        with open('/proc/sys/fs/pipe-max-size', encoding='utf-8') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+def setPipeSize(pipe, size) -> Optional[int]:
+    '''
+    Raise the capacity of a pipe to size bytes, or 'max' for the system limit.
+    Returns the capacity set, None where pipes cannot be resized.
+    '''
+    if info.system != 'Linux':
+        return None
+    # pylint: disable=import-outside-toplevel
+    import fcntl
+    set_size, get_size = getattr(fcntl, 'F_SETPIPE_SZ', 1031), getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+    limit = pipeMaxSize()
+    size = limit if size == 'max' else min(int(size), limit or int(size))
+    while size is not None and size > 65536:
+        try:
+            return fcntl.fcntl(pipe.fileno(), set_size, size)
+        except OSError:
+            # over the per-user limit of pipe buffers, try a smaller one
+            size //= 2
+    return fcntl.fcntl(pipe.fileno(), get_size)
+
+def readProcStats(pid: int) -> Optional[dict]:
+    try:
+        with open(f'/proc/{pid}/stat', encoding='utf-8') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status', encoding='utf-8') as f:
+            rss = next((int(l.split()[1]) * 1024 for l in f if l.startswith('VmRSS:')), None)
+    except (OSError, IndexError, ValueError):
+        return None
+    # utime and stime are fields 14 and 15 of stat, the first 2 fields are cut above
+    return {'cpu_time': (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), 'rss': rss}
+
+class PipelineMonitor:
+    '''
+    Periodically emit progress events of a running pipeline: frames done, fps,
+    ETA, CPU and RSS of every process, and the stage holding the others back.
+    '''
+    def __init__(self, processes, relays, interval):
+        self.processes = processes
+        self.relays = relays
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start = time.perf_counter()
+        self.last = {'time': self.start, 'frames': 0, 'cpu': {}, 'waits': [(0.0, 0.0)] * len(relays)}
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.emit(self.sample())
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        event = self.sample()
+        event['event'] = 'finished'
+        self.emit(event)
+
+    def sample(self) -> dict:
+        now = time.perf_counter()
+        elapsed = now - self.last['time']
+        counter = self.relays[-1].y4m if self.relays else None
+        frames = counter.frames if counter is not None and counter.valid else None
+        total = counter.total if frames is not None else None
+        fps = (frames - self.last['frames']) / elapsed if frames is not None and elapsed > 0 else None
+        stages = []
+        cpu = {}
+        for proc in self.processes:
+            # not polled, reaping is left to invokePipeline so it gets the resource usage
+            stats = readProcStats(proc.pid) if proc.returncode is None else None
+            stage = {'stage': os.path.basename(proc.args[0]), 'pid': proc.pid, 'cpu': None, 'rss': None}
+            if stats is not None:
+                cpu[proc.pid] = stats['cpu_time']
+                if proc.pid in self.last['cpu'] and elapsed > 0:
+                    stage['cpu'] = (stats['cpu_time'] - self.last['cpu'][proc.pid]) / elapsed
+                stage['rss'] = stats['rss']
+            stages.append(stage)
+        # every relay blames the side it waited on the most during this interval
+        blame = [0.0] * len(self.processes)
+        waits = []
+        for idx, relay in enumerate(self.relays):
+            read_wait, write_wait = relay.read_wait, relay.write_wait
+            last_read, last_write = self.last['waits'][idx]
+            blame[idx] += read_wait - last_read
+            blame[idx + 1] += write_wait - last_write
+            waits.append((read_wait, write_wait))
+        bottleneck = stages[blame.index(max(blame))]['stage'] if self.relays and max(blame) > 0 else None
+        self.last = {'time': now, 'frames': frames or 0, 'cpu': cpu, 'waits': waits}
+        eta = None
+        if frames is not None and total and fps:
+            eta = (total - frames) / fps
+        return {
+            'event': 'progress',
+            'elapsed': now - self.start,
+            'frames': frames,
+            'total_frames': total,
+            'fps': fps,
+            'eta': eta,
+            'bytes': [relay.bytes for relay in self.relays],
+            'bottleneck': bottleneck,
+            'stages': stages,
+        }
+
+    def emit(self, event: dict) -> None:
+        def fmt(v, f):
+            return '-' if v is None else f.format(v)
+        logger.info(f'Pipeline: {event["event"]} frames {fmt(event["frames"], "{}")}/{fmt(event["total_frames"], "{}")}, '
+                    f'{fmt(event["fps"], "{:.2f}")} fps, ETA {fmt(event["eta"], "{:.0f}")} s, '
+                    f'bottleneck {fmt(event["bottleneck"], "{}")}')
+        for listener in progress_listeners:
+            try:
+                listener(event)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('Pipeline: progress listener failed')
+
+def waitProcess(proc: Popen, block: bool = True) -> Optional[int]:
+    '''
+    Popen.wait (or Popen.poll if not block), reaping with os.wait4 where it is
+    available, so the resource usage of the process is recorded.
+    '''
+    if proc.returncode is not None or not hasattr(os, 'wait4'):
+        return proc.wait() if block else proc.poll()
+    pid, status, rusage = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    recordChildUsage(rusage)
+    return proc.returncode
+
+@contextmanager
+def pipelinePlacement(placement, stages: int):
+    '''
+    CPU sets of each stage of a pipeline, or None when it is not placed.
+    placement is 'node', to run the whole pipeline on the NUMA node with the
+    fewest pipelines (counted across processes of this host while they run),
+    or a list of per-stage cpulists ('0-15,32-47') or nodes ('node1').
+    '''
+    if not placement or placement == 'none' or not hasattr(os, 'sched_setaffinity'):
+        yield None
+        return
+    nodes = numa_nodes()
+    if placement != 'node':
+        if len(placement) != stages:
+            raise ValueError(f'Placement has {len(placement)} CPU sets for {stages} stages')
+        cpusets = []
+        for p in placement:
+            # YAML gives ints for single CPUs
+            p = str(p)
+            if p.startswith('node'):
+                if int(p[4:]) not in nodes:
+                    raise ValueError(f'Placement: NUMA node {p[4:]} has no CPUs usable by this process, usable nodes: {list(nodes)}')
+                cpusets.append(nodes[int(p[4:])])
+            else:
+                try:
+                    cpusets.append(parse_cpulist(p))
+                except ValueError:
+                    raise ValueError(f"Placement: '{p}' is neither a cpulist ('0-15,32-47') nor a node ('node1')") from None
+        yield cpusets
+        return
+    # pylint: disable=import-outside-toplevel
+    import fcntl
+    slots = os.path.join(tempfile.gettempdir(), 'tree_diagram_placement')
+    os.makedirs(slots, exist_ok=True)
+    with open(os.path.join(slots, 'lock'), 'w', encoding='utf-8') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        # slots are named after the real node id, processes with other affinity masks agree on them
+        busy = {node: 0 for node in nodes}
+        for name in os.listdir(slots):
+            if name == 'lock':
+                continue
+            with open(os.path.join(slots, name), 'r', encoding='utf-8') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # nobody holds it, left behind by a killed process
+                    os.remove(os.path.join(slots, name))
+                except BlockingIOError:
+                    node = int(name.split('.')[0][4:])
+                    if node in busy:
+                        busy[node] += 1
+        node = min(busy, key=lambda n: busy[n])
+        fd, path = tempfile.mkstemp(prefix=f'node{node}.', dir=slots)
+        slot = os.fdopen(fd, 'w', encoding='utf-8')
+        fcntl.flock(slot, fcntl.LOCK_EX)
+    logger.info(f'Placement: pipeline on NUMA node {node} ({len(nodes[node])} CPUs), {busy[node]} other pipeline(s) there')
+    try:
+        yield [nodes[node]] * stages
+    finally:
+        os.remove(path)
+        slot.close()
+
+def invokePipeline(pipeline: List[List[str]], instrument: bool = False, interval: float = 10.0,
+                   affinity: Optional[List[set]] = None, transport: str = 'pipe', pipe_size=None,
+                   ring_frames: int = 8) -> None:
+    '''
+    instrument: relay the pipes through TreeDiagram and emit progress events to the progress
+    listeners every interval seconds.
+    affinity: CPU set of each process, see pipelinePlacement.
+    transport: 'pipe' connects the processes directly (relayed by copying when instrumented),
+    'splice' relays with os.splice, 'ring' relays through a ring buffer of ring_frames y4m frames.
+    pipe_size: capacity of the pipes in bytes, or 'max' for /proc/sys/fs/pipe-max-size.
+    '''
+    if transport not in ['pipe', 'splice', 'ring']:
+        raise ValueError(f'Unknown pipe transport {transport}')
+    relayed = instrument or transport != 'pipe'
     processes = []
     check_exit = []
+    relays = []
+    commands = [cmd for cmd in pipeline if not isinstance(cmd, bool)]
     for cmd in pipeline:
         if isinstance(cmd, bool):
             check_exit[-1] = cmd
@@ -22,22 +473,52 @@ def invokePipeline(pipeline: List[List[str]]) -> None:
             if bininfo['fileformat'] == 'PE' or (bininfo['fileformat'] == 'ELF' and 'libwine.so.1' in bininfo['dependencies']):
                 cmd = [info.WINE] + cmd
         stdin = processes[-1].stdout if len(processes) > 0 else None
-        stdout = subprocess.PIPE if len(processes) < len(pipeline) - 1 else None
-        processes.append(Popen(args=cmd, stdin=stdin, stdout=stdout, bufsize=0))
+        if stdin is not None and relayed:
+            stdin = subprocess.PIPE
+        stdout = subprocess.PIPE if len(processes) < len(commands) - 1 else None
+        if affinity is not None:
+            # the child inherits the affinity of the spawning thread, so it is pinned before exec
+            # (vspipe and the encoders size their thread pools from it) without a preexec_fn,
+            # which is unsafe while relay and pool threads are running
+            spawning = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, affinity[len(processes)])
+            try:
+                processes.append(Popen(args=cmd, stdin=stdin, stdout=stdout, bufsize=0))
+            finally:
+                os.sched_setaffinity(0, spawning)
+        else:
+            processes.append(Popen(args=cmd, stdin=stdin, stdout=stdout, bufsize=0))
         #processes.append(Popen(cmd))
         #processes.append(Popen(args=cmd, stdin=stdin, stderr=subprocess.STDOUT, bufsize=0))
         check_exit.append(False)
-        if stdin:
+        if pipe_size is not None:
+            for pipe in [processes[-1].stdin, processes[-1].stdout]:
+                if pipe is not None:
+                    setPipeSize(pipe, pipe_size)
+        if stdin == subprocess.PIPE:
+            if transport == 'splice':
+                relays.append(SpliceRelay(processes[-2].stdout, processes[-1].stdin))
+            elif transport == 'ring':
+                relays.append(RingRelay(processes[-2].stdout, processes[-1].stdin, ring_frames))
+            else:
+                relays.append(PipeRelay(processes[-2].stdout, processes[-1].stdin))
+        elif stdin:
             stdin.close()
+    monitor = PipelineMonitor(processes, relays, interval) if instrument else None
     try:
-        processes[-1].wait()
+        waitProcess(processes[-1])
     finally:
         # last process exited or external interruption, terminate all processes if still running
         for proc in processes:
-            if proc.poll() is None:
+            if waitProcess(proc, block=False) is None:
                 proc.terminate()
+        for relay in relays:
+            relay.thread.join(5)
+        if monitor is not None:
+            monitor.stop()
         for proc, check in zip(processes, check_exit):
-            code = proc.poll()
+            # an upstream process may close its output a moment before it can be reaped
+            code = waitProcess(proc)
             if check and code != 0:
                 logger.critical(f'Process exited with {code}: {" ".join(proc.args)}')
                 raise ExitException(-1)
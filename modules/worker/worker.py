@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import time
+import json
 import logging
 import pathlib
 import os
@@ -13,6 +14,7 @@ import requests
 
 import modules.tree_diagram as tree_diagram
 from modules.tree_diagram import info, ExitException, syncContent
+from modules.tree_diagram.process_utils import progress_listeners
 
 logger = logging.getLogger('tree_diagram:worker')
 
@@ -37,6 +39,9 @@ class Worker:
         self.heartbeat_sent = True
         self.task_id = None
         self.status = TASK_STATUS_WAITING
+        self.progress_event = None
+        # only pipelines instrumented by performance.telemetry report progress
+        progress_listeners.append(self.progress)
         self.heartbeat_thread.start()
 
     def load_config(self, filepath):
@@ -65,6 +70,11 @@ class Worker:
             self.heartbeat_cond.notify_all()
             self.heartbeat_cond.wait_for(lambda: self.heartbeat_sent)
 
+    def progress(self, event):
+        # latest pipeline progress, forwarded with the next heartbeat
+        with self.heartbeat_cond:
+            self.progress_event = event
+
     def task_fail(self):
         try:
             self.task_status(TASK_STATUS_ERROR)
@@ -146,6 +156,7 @@ class Worker:
                 with self.heartbeat_cond:
                     self.task_id = None
                     self.status = TASK_STATUS_WAITING
+                    self.progress_event = None
                 time.sleep(self.config['PollingInterval'])
 
     def download(self, url, path, sha256sum):
@@ -177,10 +188,13 @@ class Worker:
                 if task_id is None:
                     assert self.heartbeat_sent
                     continue
-                r = requests.put(self.ep + f'/task/{task_id}', data={
+                data = {
                     'client_id': self.client_id,
                     'task_status': self.status
-                })
+                }
+                if self.progress_event is not None:
+                    data['progress'] = json.dumps(self.progress_event)
+                r = requests.put(self.ep + f'/task/{task_id}', data=data)
                 if r.status_code != 200 or r.json()['code'] != 200:
                     logger.warning(r.text)
                 self.heartbeat_sent = True